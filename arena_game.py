@@ -1,15 +1,24 @@
+import time
+STARTED = time.perf_counter()  # for time-to-first-menu-frame; taken before the slow imports
+
 import pygame
+import os
 import math
+import hashlib
+import struct
+import json
+import csv
 import random
+import threading
+from collections import OrderedDict
+import numpy as np
+import argparse
 
-pygame.init()
-pygame.mixer.init(frequency=22050, size=-16, channels=2, buffer=512)
-pygame.joystick.init()
-
-info = pygame.display.Info()
-WIDTH, HEIGHT = info.current_w, info.current_h
-screen = pygame.display.set_mode((WIDTH, HEIGHT), pygame.FULLSCREEN)
-pygame.display.set_caption("2 Player Arena")
+# Importing sets nothing up: init_display() opens the window when there is
+# one to draw to, and finish_startup() does the rest after the first menu frame
+WIDTH, HEIGHT = 1200, 700  # the render resolution once init_display() has run
+screen = None   # everything is drawn here: the display, or an offscreen surface scaled to it
+display = None  # the window itself
 
 clock = pygame.time.Clock()
 FPS = 60
@@ -26,91 +35,563 @@ YELLOW = (255,220,50)
 ORANGE = (255,140,50)
 PURPLE = (200,100,255)
 
-font = pygame.font.SysFont("Arial", 20)
-big_font = pygame.font.SysFont("Arial", 32, bold=True)
-title_font = pygame.font.SysFont("Arial", 80, bold=True)
-menu_font = pygame.font.SysFont("Arial", 40, bold=True)
+class LazyFont:
+    """A SysFont that is only looked up the first time something is drawn with
+    it, since finding system fonts is one of the slowest parts of startup"""
+    def __init__(self, name, size, bold=False):
+        self.args = (name, size, bold)
+        self.font = None
 
-# Particle system
-particles = []
-camera_offset = [0, 0]  # For moving background effect
+    def __getattr__(self, name):
+        if self.font is None:
+            self.font = pygame.font.SysFont(*self.args)
+        return getattr(self.font, name)
 
-class Particle:
-    def __init__(self, x, y, vx, vy, color, lifetime):
-        self.x = x
-        self.y = y
-        self.vx = vx
-        self.vy = vy
-        self.color = color
-        self.lifetime = lifetime
-        self.max_lifetime = lifetime
-        self.radius = 3
+font = LazyFont("Arial", 20)
+big_font = LazyFont("Arial", 32, bold=True)
+title_font = LazyFont("Arial", 80, bold=True)
+menu_font = LazyFont("Arial", 40, bold=True)
+instr_font = LazyFont("Arial", 24)
 
-    def update(self):
-        self.x += self.vx
-        self.y += self.vy
-        self.lifetime -= 1
-        self.vy += 0.1  # Gravity
-        self.radius = max(1, 3 * (self.lifetime / self.max_lifetime))
+def init_display(fullscreen=True, render_size=None):
+    """Open the game window (fullscreen at the desktop size) and set WIDTH,
+    HEIGHT and screen to match. With a render_size the scene is drawn at that
+    resolution instead, offscreen, and present() scales it to fit the window
+    (letterboxed if the shapes differ); arenas are generated to the render
+    size, so it is also the size of the play area."""
+    global WIDTH, HEIGHT, screen, display, view
+    pygame.display.init()
+    pygame.font.init()
+    info = pygame.display.Info()
+    if fullscreen:
+        WIDTH, HEIGHT = info.current_w, info.current_h
+    display = pygame.display.set_mode((WIDTH, HEIGHT), pygame.FULLSCREEN if fullscreen else 0)
+    pygame.display.set_caption("2 Player Arena")
+    if render_size is None or tuple(render_size) == display.get_size():
+        screen = display
+        view = display.get_rect()
+    else:
+        WIDTH, HEIGHT = render_size
+        screen = pygame.Surface(render_size).convert()
+        view = screen.get_rect().fit(display.get_rect())
+        display.fill((0, 0, 0))
+    return screen
 
-    def draw(self):
-        alpha = int(255 * (self.lifetime / self.max_lifetime))
-        pygame.draw.circle(screen, self.color, (int(self.x), int(self.y)), max(1, int(self.radius)))
+view = None  # the part of the display the scene is shown in
+
+def present(rects=None):
+    """Show the finished frame: flip the whole display, or with rects only send
+    those areas. A scene rendered at its own resolution is scaled to the
+    display first, and then always flipped whole."""
+    if screen is display:
+        if rects is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(rects)
+        return
+    pygame.transform.scale(screen, view.size, display.subsurface(view))
+    pygame.display.flip()
+
+def mouse_position(pos=None):
+    """The mouse position, or pos (from a mouse event), in render coordinates"""
+    x, y = pygame.mouse.get_pos() if pos is None else pos
+    if screen is display:
+        return x, y
+    return ((x - view.x) * WIDTH // view.w, (y - view.y) * HEIGHT // view.h)
+
+first_frame_ms = None  # time from launch to the first menu frame, once it's shown
+startup_finished = False
+
+def finish_startup():
+    """Everything the first menu frame doesn't need, done once it's on screen:
+    open the mixer and controllers, warm up the sounds and the other fonts"""
+    global startup_finished
+    if startup_finished:
+        return
+    startup_finished = True
+    try:
+        pygame.mixer.init(frequency=22050, size=-16, channels=2, buffer=512)
+    except pygame.error:
+        pass  # no audio device; sounds fall back to DummySound
+    sounds.open()
+    pygame.joystick.init()
+    for sound in (shoot_sound, hit_sound, ui_sound):
+        sound.get()
+    for lazy_font in (font, big_font):
+        lazy_font.get_linesize()
+
+SURFACE_CACHE_SIZE = 512  # entries for text, HUD pieces and a couple of players
+
+class SurfaceCache:
+    """LRU cache of pre-rendered surfaces (text, player bodies, HUD pieces).
+
+    get() returns the cached surface for a key, or calls render() to make it
+    and evicts the least recently used entry once capacity is reached. hits and
+    misses count lookups since the cache was created.
+    """
+    def __init__(self, capacity=SURFACE_CACHE_SIZE):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, render):
+        surface = self.entries.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return surface
+        self.misses += 1
+        surface = render()
+        self.entries[key] = surface
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        return surface
+
+    def reserve(self, capacity):
+        """Grow to hold at least capacity entries (it never shrinks)"""
+        self.capacity = max(self.capacity, capacity)
+
+    def clear(self):
+        self.entries.clear()
+
+surface_cache = SurfaceCache()
+
+PROFILE_PHASES = ("input", "players", "bullets", "obstacles", "effects",
+                  "background", "draw_bullets", "draw_players", "hud", "present")
+
+def _no_op(*args):
+    pass
+
+class FrameProfiler:
+    """Per-phase frame timings kept in a ring buffer of the last `frames` frames.
+
+    The main loop calls begin_frame(), then lap(phase) after each phase, which
+    charges the time since the previous lap to that phase (laps add up if a
+    phase runs more than once a frame), then end_frame(). While disabled these
+    methods are bound to a no-op, so instrumentation costs one call per lap.
+    """
+    def __init__(self, phases=PROFILE_PHASES, frames=600):
+        self.phases = phases
+        self.index = {name: i for i, name in enumerate(phases)}
+        self.samples = np.zeros((frames, len(phases)))  # seconds
+        self.frames = 0  # frames recorded so far
+        self.last = 0.0
+        self.row = np.zeros(len(phases))  # frame being recorded
+        self.set_enabled(False)
+
+    def set_enabled(self, enabled):
+        self.enabled = enabled
+        if enabled:
+            self.begin_frame = self._begin_frame
+            self.lap = self._lap
+            self.end_frame = self._end_frame
+        else:
+            self.begin_frame = self.lap = self.end_frame = _no_op
+
+    def _begin_frame(self):
+        self.row[:] = 0
+        self.last = time.perf_counter()
+
+    def _lap(self, phase):
+        now = time.perf_counter()
+        self.row[self.index[phase]] += now - self.last
+        self.last = now
+
+    def _end_frame(self):
+        self.samples[self.frames % len(self.samples)] = self.row
+        self.frames += 1
+
+    def recorded(self):
+        """Recorded frames in ms, oldest first"""
+        size = len(self.samples)
+        if self.frames <= size:
+            return self.samples[:self.frames] * 1000
+        start = self.frames % size
+        return np.concatenate((self.samples[start:], self.samples[:start])) * 1000
+
+    def summary(self):
+        """{phase: {"p50": ms, "p99": ms, "mean": ms}} over the recorded frames"""
+        frames = self.recorded()
+        if not len(frames):
+            return {}
+        p50, p99 = np.percentile(frames, (50, 99), axis=0)
+        mean = frames.mean(axis=0)
+        return {phase: {"p50": float(p50[i]), "p99": float(p99[i]), "mean": float(mean[i])}
+                for i, phase in enumerate(self.phases)}
+
+    def export(self, path):
+        """Write the recorded frames (ms per phase) to a .json or .csv file"""
+        frames = self.recorded()
+        if path.endswith(".json"):
+            with open(path, "w") as f:
+                json.dump({"phases": list(self.phases), "summary": self.summary(),
+                           "frames_ms": frames.round(4).tolist()}, f, indent=1)
+        else:
+            with open(path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(("frame",) + tuple(self.phases))
+                first = self.frames - len(frames)
+                for i, row in enumerate(frames.tolist()):
+                    writer.writerow([first + i] + [f"{ms:.4f}" for ms in row])
+
+profiler = FrameProfiler()
+
+TELEMETRY_RECORD = np.dtype([("time", "<f8"), ("kind", "u1"), ("a", "<i2"), ("b", "<i2"), ("c", "<i4"),
+                             ("x", "<f4"), ("y", "<f4"), ("z", "<f4")])
+TELEMETRY_FIELDS = {  # kind: names of a, b, c, x, y, z (None where unused)
+    "match": ("players", "bots", "obstacles", None, None, None),
+    "shoot": ("player", "weapon", None, None, None, None),
+    "hit": ("player", "shooter", "weapon", "damage", None, None),
+    "switch": ("player", "weapon", None, None, None, None),
+    "game_over": ("winner", None, "ticks", "seconds", None, None),
+    "frames": ("sampled", None, "frames", "p50_ms", "max_ms", "work_p50_ms"),
+}
+TELEMETRY_KINDS = tuple(TELEMETRY_FIELDS)
+TELEMETRY_MAGIC = b"ARENATEL"
+TELEMETRY_VERSION = 2  # 2: c is 32-bit, for tick and frame counts
+
+class Telemetry:
+    """Match events and per-second frame stats, streamed to disk off the main thread.
+
+    record() stores one TELEMETRY_RECORD in a preallocated ring buffer and
+    never waits: if the writer thread has fallen a whole buffer behind, the
+    event is dropped and counted instead. The writer wakes every interval
+    seconds and appends what's new to path, as JSON lines or, for a .bin path,
+    as raw records after a short header (see read_telemetry()). A file that
+    passes max_bytes is rotated like a log, path to path.1 to path.2 and so
+    on, keeping backups old ones. Until open() the methods do nothing.
+    """
+    def __init__(self, capacity=65536):
+        self.buffer = np.zeros(capacity, TELEMETRY_RECORD)
+        self.head = 0  # records stored, only advanced by the main thread
+        self.tail = 0  # records written, only advanced by the writer
+        self.dropped = 0
+        self.thread = None
+        self.frame_times = np.zeros((1000, 2))  # this second's last frame intervals and work times
+        self.frames = 0  # every frame this second, even past len(frame_times)
+        self.frame_max = 0.0
+        self.second = None
+
+    def open(self, path, max_bytes=8 << 20, backups=5, interval=0.5):
+        self.path = path
+        self.binary = path.endswith(".bin")
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.interval = interval
+        self.file = None
+        self.wake = threading.Event()
+        self.closing = False
+        self.thread = threading.Thread(target=self._write_loop, name="telemetry", daemon=True)
+        self.thread.start()
+
+    def record(self, kind, a=0, b=0, c=0, x=0.0, y=0.0, z=0.0):
+        if self.thread is None:
+            return
+        if self.head - self.tail >= len(self.buffer):
+            self.dropped += 1
+            return
+        self.buffer[self.head % len(self.buffer)] = (time.time(), TELEMETRY_KINDS.index(kind), a, b, c, x, y, z)
+        self.head += 1
+
+    def match_start(self, sim, bots=0):
+        self.record("match", len(sim.players), bots, len(sim.obstacles))
+
+    def sim_events(self, sim):
+        """Record the shots, hits and weapon switches of the tick sim just stepped"""
+        if self.thread is None:
+            return
+        for shooter, weapon in sim.shots:
+            self.record("shoot", shooter, weapon)
+        for kind, player in sim.events:
+            if kind == "switch":
+                self.record(kind, sim.players.index(player), player.weapon)
+        for target, shooter, weapon, damage in sim.hits:
+            self.record("hit", target, shooter, weapon, damage)
+
+    def game_over(self, sim):
+        winner = next((i for i, player in enumerate(sim.players) if player.hp > 0), -1)
+        self.record("game_over", winner if sim.winner != "NOBODY" else -1, c=sim.ticks,
+                    x=sim.time / 1000)
+
+    def frame(self, interval, work):
+        """Count one frame; once a second the frame stats go out as a "frames" event.
+
+        Every frame is counted and the max is over all of them, but the medians
+        are over the last len(frame_times), which is how many "sampled" says.
+        """
+        if self.thread is None:
+            return
+        second = int(time.perf_counter())
+        if second != self.second and self.frames:
+            sampled = min(self.frames, len(self.frame_times))
+            p50 = np.median(self.frame_times[:sampled] * 1000, axis=0)
+            self.record("frames", sampled, c=self.frames,
+                        x=p50[0], y=self.frame_max * 1000, z=p50[1])
+            self.frames = 0
+            self.frame_max = 0.0
+        self.second = second
+        self.frame_times[self.frames % len(self.frame_times)] = interval, work
+        self.frames += 1
+        self.frame_max = max(self.frame_max, interval)
+
+    def close(self):
+        """Write out everything recorded so far and stop the writer"""
+        if self.thread is None:
+            return
+        self.closing = True
+        self.wake.set()
+        self.thread.join()
+        self.thread = None
+
+    def _write_loop(self):
+        while True:
+            closing = self.closing
+            head = self.head
+            if head > self.tail:
+                self._write(head)
+            if closing:
+                break
+            self.wake.wait(self.interval)
+        if self.file:
+            self.file.close()
+
+    def _write(self, head):
+        size = len(self.buffer)
+        start, end = self.tail % size, head % size
+        if start < end:
+            records = self.buffer[start:end].copy()
+        else:
+            records = np.concatenate((self.buffer[start:], self.buffer[:end]))
+        self.tail = head
+        if self.file is None:
+            self.file = open(self.path, "ab")
+            if self.binary and not self.file.tell():
+                self.file.write(TELEMETRY_MAGIC + struct.pack("<H", TELEMETRY_VERSION))
+        if self.binary:
+            self.file.write(records.tobytes())
+        else:
+            lines = []
+            for record in records.tolist():
+                kind = TELEMETRY_KINDS[record[1]]
+                event = {"time": round(record[0], 4), "event": kind}
+                for name, value in zip(TELEMETRY_FIELDS[kind], record[2:]):
+                    if name:
+                        event[name] = round(value, 3) if isinstance(value, float) else value
+                lines.append(json.dumps(event))
+            self.file.write(("\n".join(lines) + "\n").encode())
+        self.file.flush()
+        if self.file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self.file.close()
+        self.file = None
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+def read_telemetry(path):
+    """The records of a binary telemetry file, as a TELEMETRY_RECORD array"""
+    with open(path, "rb") as f:
+        data = f.read()
+    header = len(TELEMETRY_MAGIC) + 2
+    if data[:len(TELEMETRY_MAGIC)] != TELEMETRY_MAGIC:
+        raise ValueError(f"{path} is not a telemetry file")
+    version, = struct.unpack_from("<H", data, len(TELEMETRY_MAGIC))
+    if version != TELEMETRY_VERSION:
+        raise ValueError(f"{path} is telemetry version {version}, expected {TELEMETRY_VERSION}")
+    usable = (len(data) - header) // TELEMETRY_RECORD.itemsize * TELEMETRY_RECORD.itemsize
+    return np.frombuffer(data, TELEMETRY_RECORD, offset=header, count=usable // TELEMETRY_RECORD.itemsize)
+
+telemetry = Telemetry()
+
+def render_text(text_font, text, color):
+    """font.render(), cached per font, string and color"""
+    return surface_cache.get(("text", id(text_font), text, color),
+                             lambda: text_font.render(text, True, color))
+
+camera_offset = [0, 0]  # For moving background effect
+view_offset = [0, 0]    # world position shown at the screen's top-left corner
 
 # Sound generation
-def generate_sound(frequency, duration, volume=0.3):
-    """Generate a simple sine wave sound without numpy using pygame mixer"""
-    sample_rate = 22050
+SOUND_CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+                               "arena_game", "sounds")
+SYNTH_VERSION = 1  # bump when synthesize() output changes, to invalidate cached PCM
+
+SAMPLE_TYPES = {8: np.uint8, -8: np.int8, 16: np.uint16, -16: np.int16, 32: np.float32}
+
+def synthesize(frequency, duration, volume, attack, release, mixer_format):
+    """Render a sine wave with a linear attack/release envelope to raw PCM bytes"""
+    sample_rate, size, channels = mixer_format
     frames = int(duration * sample_rate)
-    
-    import array
-    arr = array.array('h')  # signed short integer
-    for i in range(frames):
-        # Generate sine wave
-        sample = math.sin(2.0 * math.pi * frequency * i / sample_rate)
-        sample = int(sample * 32767 * volume)
-        arr.append(sample)
-        arr.append(sample)  # stereo - same for both channels
-    
+    wave = np.sin(2.0 * np.pi * frequency * np.arange(frames) / sample_rate) * volume
+
+    attack_frames = min(frames, int(attack * sample_rate))
+    release_frames = min(frames, int(release * sample_rate))
+    if attack_frames:
+        wave[:attack_frames] *= np.linspace(0.0, 1.0, attack_frames, endpoint=False)
+    if release_frames:
+        wave[frames - release_frames:] *= np.linspace(1.0, 0.0, release_frames)
+
+    sample_type = SAMPLE_TYPES[size]
+    if sample_type is np.float32:
+        samples = wave.astype(np.float32)
+    else:
+        info = np.iinfo(sample_type)
+        if info.min < 0:
+            samples = (wave * info.max).astype(sample_type)
+        else:
+            # Unsigned samples are centred on the middle of their range
+            half = info.max // 2
+            samples = (wave * half + half + 1).astype(sample_type)
+    # Same signal on every channel
+    return np.repeat(samples, channels).tobytes()
+
+def load_pcm(frequency, duration, volume, attack, release, mixer_format):
+    """PCM for a sound effect, read from the on-disk cache or synthesized and stored there"""
+    params = (SYNTH_VERSION, frequency, duration, volume, attack, release, tuple(mixer_format))
+    key = hashlib.sha1(repr(params).encode()).hexdigest()
+    path = os.path.join(SOUND_CACHE_DIR, key + ".pcm")
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        pass
+
+    pcm = synthesize(frequency, duration, volume, attack, release, mixer_format)
+    try:
+        os.makedirs(SOUND_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(pcm)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass  # The cache is only an optimization
+    return pcm
+
+class DummySound:
+    def play(self):
+        pass
+
+def generate_sound(frequency, duration, volume=0.3, attack=0, release=0):
+    """Generate a sine wave sound in the mixer's own format"""
+    mixer_format = pygame.mixer.get_init()
+    if not mixer_format:
+        return DummySound()
+
     # Create sound from buffer
     try:
-        sound = pygame.mixer.Sound(buffer=arr.tobytes())
-        return sound
+        pcm = load_pcm(frequency, duration, volume, attack, release, mixer_format)
+        return pygame.mixer.Sound(buffer=pcm)
     except Exception as e:
         # If sound creation fails, return a dummy object
-        class DummySound:
-            def play(self):
-                pass
         return DummySound()
 
-# Pre-generate sound effects
-shoot_sound = generate_sound(800, 0.1, 0.3)  # Pew sound
-hit_sound = generate_sound(400, 0.15, 0.3)   # Impact sound
-ui_sound = generate_sound(600, 0.08, 0.2)    # UI beep
+class SynthSound:
+    """A generated sound effect that is only synthesized (or loaded from the
+    cache) the first time it is played, keeping it off the startup path.
+    group is the SOUND_GROUPS channel group it plays on, and max_voices how
+    many copies of it may sound at once; it is played through the SoundMixer,
+    which enforces both."""
+    def __init__(self, frequency, duration, volume=0.3, attack=0, release=0, group="ui", max_voices=1):
+        self.params = (frequency, duration, volume, attack, release)
+        self.group = group
+        self.max_voices = max_voices
+        self.sound = None
+
+    def get(self):
+        if self.sound is None:
+            if not pygame.mixer.get_init():
+                return DummySound()  # not yet, or never; try again next time
+            self.sound = generate_sound(*self.params)
+        return self.sound
+
+SOUND_GROUPS = {"shot": 8, "hit": 6, "ui": 2}  # channels reserved for each kind of sound
+
+class SoundMixer:
+    """Plays sound effects on reserved channel groups.
+
+    play() only queues a sound, so it costs next to nothing and can't fail in
+    the middle of a frame; a sound queued more than once before the next
+    flush() is played once. flush(), once per frame, starts each queued sound
+    on a free channel of its group. When the group is full, or the sound
+    already has max_voices copies playing, the oldest of those is cut off and
+    reused, rather than SDL picking a channel at random.
+    """
+    def __init__(self, groups=SOUND_GROUPS):
+        self.groups = groups
+        self.channels = None  # {group: [Channel]} once open() has run
+        self.started = {}     # Channel: pygame.time.get_ticks() when its sound started
+        self.pending = {}     # SynthSound: None, in the order they were queued
+        self.played = self.merged = self.stolen = self.failed = 0
+
+    def open(self):
+        """Reserve the channel groups; does nothing without a mixer"""
+        if not pygame.mixer.get_init():
+            return
+        total = sum(self.groups.values())
+        pygame.mixer.set_num_channels(total)
+        pygame.mixer.set_reserved(total)
+        self.channels = {}
+        first = 0
+        for group, count in self.groups.items():
+            self.channels[group] = [pygame.mixer.Channel(i) for i in range(first, first + count)]
+            first += count
+
+    def play(self, sound):
+        if self.channels is None:
+            return
+        if sound in self.pending:
+            self.merged += 1
+        else:
+            self.pending[sound] = None
+
+    def flush(self):
+        if not self.pending:
+            return
+        now = pygame.time.get_ticks()
+        for sound in self.pending:
+            channels = self.channels[sound.group]
+            sample = sound.get()
+            busy = [channel for channel in channels if channel.get_busy()]
+            voices = [channel for channel in busy if channel.get_sound() == sample]
+            if len(voices) >= sound.max_voices:
+                channel = min(voices, key=self.started.get)
+                self.stolen += 1
+            elif len(busy) < len(channels):
+                channel = next(channel for channel in channels if not channel.get_busy())
+            else:
+                channel = min(busy, key=self.started.get)
+                self.stolen += 1
+            try:
+                channel.play(sample)
+            except (pygame.error, TypeError):
+                self.failed += 1  # e.g. a DummySound, if the sound couldn't be generated
+                continue
+            self.started[channel] = now
+            self.played += 1
+        self.pending.clear()
+
+sounds = SoundMixer()
+
+# Sound effects, generated on first use
+shoot_sound = SynthSound(800, 0.1, 0.3, group="shot", max_voices=6)  # Pew sound
+hit_sound = SynthSound(400, 0.15, 0.3, group="hit", max_voices=4)    # Impact sound
+ui_sound = SynthSound(600, 0.08, 0.2, group="ui", max_voices=1)      # UI beep
 
 def play_shoot_sound():
-    try:
-        shoot_sound.play()
-    except:
-        pass
+    sounds.play(shoot_sound)
 
 def play_hit_sound():
-    try:
-        hit_sound.play()
-    except:
-        pass
+    sounds.play(hit_sound)
 
 def play_ui_sound():
-    try:
-        ui_sound.play()
-    except:
-        pass
-
-# Controller
-controller = None
-if pygame.joystick.get_count() > 0:
-    controller = pygame.joystick.Joystick(0)
-    controller.init()
+    sounds.play(ui_sound)
 
 def normalize_angle_diff(target, current):
     """Calculate shortest angle difference for smooth 360-degree rotation"""
@@ -128,12 +609,49 @@ WEAPONS = {
     2: {"name": "Sniper", "damage": 20, "delay": 750, "speed": 18, "color": PURPLE},
 }
 
+# Movement and projectile speeds are tuned in pixels per frame at BASE_RATE and
+# scaled to whatever rate the simulation actually ticks at
+BASE_RATE = 60
+SIM_RATE = 60  # default simulation ticks per second
+MAX_FRAME_TIME = 0.25  # longest real frame the simulation will try to catch up on
+MAX_STEPS_PER_FRAME = 8
+
+PLAYER_SPEED = 5
+PLAYER_RADIUS = 20
+WEAPON_SWITCH_DEBOUNCE = 200  # ms between controller weapon switches
+
+PLAYER_ANGLE_STEPS = 64  # aim directions the cached player bodies are rendered at
+
+MIN_PLAYERS, MAX_PLAYERS = 2, 8
+PLAYER_COLORS = (BLUE, GREEN, RED, ORANGE, PURPLE, CYAN, YELLOW, WHITE)
+
+SCROLLING_ARENA = (1920, 1080)  # an arena bigger than this is expected not to fit on screen...
+SPAWN_SPREAD = (1200, 700)      # ...so its spawns only spread over this much of its middle
+
+def spawn_points(count, width, height):
+    """Evenly spaced starting positions on an ellipse around the arena center,
+    player 1 on the left; in a scrolling arena, close enough together that
+    everyone starts in view"""
+    spread_x, spread_y = width, height
+    if width > SCROLLING_ARENA[0] or height > SCROLLING_ARENA[1]:
+        spread_x, spread_y = min(width, SPAWN_SPREAD[0]), min(height, SPAWN_SPREAD[1])
+    points = []
+    for i in range(count):
+        angle = math.pi + 2 * math.pi * i / count
+        points.append((round(width / 2 + math.cos(angle) * spread_x / 3),
+                       round(height / 2 + math.sin(angle) * spread_y / 3)))
+    return points
+
 class Player:
-    def __init__(self, x, y, color):
+    def __init__(self, x, y, color, name="P1"):
         self.x = x
         self.y = y
+        self.prev_x = x  # state at the start of the last tick, for interpolation
+        self.prev_y = y
+        self.prev_angle = 0
         self.color = color
-        self.radius = 20
+        self.name = name
+        self.radius = PLAYER_RADIUS
         self.hp = 70
         self.max_hp = 70
         self.weapon = 0
@@ -142,96 +660,420 @@ class Player:
         self.last_hit_time = 0
         self.last_weapon_switch = 0
 
-    def draw(self):
-        # Draw enhanced glow effect with multiple layers
-        glow_color = (int(self.color[0]//3), int(self.color[1]//3), int(self.color[2]//3))
-        pygame.draw.circle(screen, glow_color, (int(self.x), int(self.y)), self.radius + 12)
-        pygame.draw.circle(screen, (int(self.color[0]//2), int(self.color[1]//2), int(self.color[2]//2)), (int(self.x), int(self.y)), self.radius + 8)
-        
-        # Draw main circle with border
-        pygame.draw.circle(screen, self.color, (int(self.x), int(self.y)), self.radius)
-        pygame.draw.circle(screen, WHITE, (int(self.x), int(self.y)), self.radius, 2)
-        
-        # Draw direction indicator (larger triangle pointing in aim direction)
-        angle = self.angle
-        front_x = self.x + math.cos(angle) * (self.radius + 12)
-        front_y = self.y + math.sin(angle) * (self.radius + 12)
-        left_x = self.x + math.cos(angle + 2.5) * self.radius * 0.8
-        left_y = self.y + math.sin(angle + 2.5) * self.radius * 0.8
-        right_x = self.x + math.cos(angle - 2.5) * self.radius * 0.8
-        right_y = self.y + math.sin(angle - 2.5) * self.radius * 0.8
-        pygame.draw.polygon(screen, WEAPONS[self.weapon]["color"], [(front_x, front_y), (left_x, left_y), (right_x, right_y)])
-        pygame.draw.polygon(screen, WHITE, [(front_x, front_y), (left_x, left_y), (right_x, right_y)], 2)
-
-        # Draw aim line (longer for sniper) with gradient effect
+    def draw(self, alpha=1.0):
+        """Draw the player alpha of the way from its previous to its current
+        tick state, and return the screen area it covered (None if it's out of
+        view, and so not drawn)"""
+        fx = self.prev_x + (self.x - self.prev_x) * alpha - view_offset[0]
+        fy = self.prev_y + (self.y - self.prev_y) * alpha - view_offset[1]
+        reach = 300 + PLAYER_RADIUS  # the sniper's aim line is the furthest anything is drawn
+        if not (-reach < fx < WIDTH + reach and -reach < fy < HEIGHT + reach):
+            return None
+        angle = self.prev_angle + normalize_angle_diff(self.angle, self.prev_angle) * alpha
+        x, y = int(fx), int(fy)
+
+        # Body: glow layers, main circle and direction indicator, pre-rendered
+        # per color, weapon, aim direction and glow setting
+        step = round(angle / (2 * math.pi) * PLAYER_ANGLE_STEPS) % PLAYER_ANGLE_STEPS
+        glow = quality.glow
+        body = surface_cache.get(("player", self.color, self.radius, self.weapon, step, glow),
+                                 lambda: self._render_body(step, glow))
+        half = body.get_width() // 2
+        bounds = screen.blit(body, (x - half, y - half))
+
+        # Draw aim line (longer for sniper)
         if self.weapon == 2:  # Sniper
             aim_length = 300
         else:
             aim_length = 80
-        
-        end_x = self.x + math.cos(angle) * aim_length
-        end_y = self.y + math.sin(angle) * aim_length
-        
-        # Draw aim line with weapon color
-        weapon_color = WEAPONS[self.weapon]["color"]
-        pygame.draw.line(screen, weapon_color, (self.x, self.y), (end_x, end_y), 3)
-        # Add glow to aim line
-        pygame.draw.line(screen, weapon_color, (self.x, self.y), (end_x, end_y), 1)
+        end_x = fx + math.cos(angle) * aim_length
+        end_y = fy + math.sin(angle) * aim_length
+        bounds.union_ip(pygame.draw.line(screen, WEAPONS[self.weapon]["color"], (fx, fy), (end_x, end_y), 3))
 
         # HP bar with enhanced styling
+        hp_bar = surface_cache.get(("hp_bar", self.hp, self.max_hp), self._render_hp_bar)
+        bounds.union_ip(screen.blit(hp_bar, (fx - 30, fy - 50)))
+
+        # Draw player name
+        bounds.union_ip(screen.blit(render_text(font, self.name, WHITE), (fx - 10, fy + 35)))
+        return bounds
+
+    def _render_body(self, step, glow=True):
+        size = (self.radius + 14) * 2
+        center = size // 2
+        surface = pygame.Surface((size, size)).convert()
+        surface.fill(COLORKEY)
+        surface.set_colorkey(COLORKEY, pygame.RLEACCEL)
+
+        # Draw enhanced glow effect with multiple layers
+        if glow:
+            glow_color = (int(self.color[0]//3), int(self.color[1]//3), int(self.color[2]//3))
+            pygame.draw.circle(surface, glow_color, (center, center), self.radius + 12)
+            pygame.draw.circle(surface, (int(self.color[0]//2), int(self.color[1]//2), int(self.color[2]//2)), (center, center), self.radius + 8)
+
+        # Draw main circle with border
+        pygame.draw.circle(surface, self.color, (center, center), self.radius)
+        pygame.draw.circle(surface, WHITE, (center, center), self.radius, 2)
+
+        # Draw direction indicator (larger triangle pointing in aim direction)
+        angle = step * 2 * math.pi / PLAYER_ANGLE_STEPS
+        front_x = center + math.cos(angle) * (self.radius + 12)
+        front_y = center + math.sin(angle) * (self.radius + 12)
+        left_x = center + math.cos(angle + 2.5) * self.radius * 0.8
+        left_y = center + math.sin(angle + 2.5) * self.radius * 0.8
+        right_x = center + math.cos(angle - 2.5) * self.radius * 0.8
+        right_y = center + math.sin(angle - 2.5) * self.radius * 0.8
+        pygame.draw.polygon(surface, WEAPONS[self.weapon]["color"], [(front_x, front_y), (left_x, left_y), (right_x, right_y)])
+        pygame.draw.polygon(surface, WHITE, [(front_x, front_y), (left_x, left_y), (right_x, right_y)], 2)
+        return surface
+
+    def _render_hp_bar(self):
         bar_width = 60
         bar_height = 10
-        ratio = self.hp / self.max_hp
-        
+        ratio = max(0, self.hp / self.max_hp)
+        surface = pygame.Surface((bar_width, bar_height)).convert()
+
         # Bar background
-        pygame.draw.rect(screen, (30, 30, 30), (self.x - 30, self.y - 50, bar_width, bar_height))
+        surface.fill((30, 30, 30))
         # Health fill (gradient color based on health)
         if ratio > 0.5:
             bar_color = (int(40 + 160 * (ratio - 0.5) * 2), 200, 40)  # Green to yellow
         else:
             bar_color = (200, int(40 + 160 * ratio * 2), 40)  # Red to yellow
-        pygame.draw.rect(screen, bar_color, (self.x - 30, self.y - 50, bar_width * ratio, bar_height))
+        pygame.draw.rect(surface, bar_color, (0, 0, bar_width * ratio, bar_height))
         # Bar border
-        pygame.draw.rect(screen, WHITE, (self.x - 30, self.y - 50, bar_width, bar_height), 2)
-        
-        # Draw player name
-        player_name = "P1" if self is player1 else "P2"
-        name_text = font.render(player_name, True, WHITE)
-        screen.blit(name_text, (self.x - 10, self.y + 35))
+        pygame.draw.rect(surface, WHITE, (0, 0, bar_width, bar_height), 2)
+        return surface
 
-class Bullet:
-    def __init__(self, x, y, angle, speed, damage, owner, color):
-        self.x = x
-        self.y = y
-        self.angle = angle
-        self.speed = speed
-        self.damage = damage
-        self.owner = owner
-        self.color = color
-        self.trail_points = []
+class ArrayPool:
+    """Fixed-capacity struct-of-arrays storage.
+
+    Slots [0, count) are live. Subclasses allocate their per-item fields with
+    _field() and fill the next free slot when spawning; remove() recycles dead
+    slots by swapping the tail into them.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.count = 0
+        self._arrays = []
+
+    def _field(self, dtype=float):
+        arr = np.zeros(self.capacity, dtype=dtype)
+        self._arrays.append(arr)
+        return arr
+
+    def __len__(self):
+        return self.count
+
+    def remove(self, dead):
+        """Drop every live item flagged in the dead mask by swapping in the tail"""
+        n = self.count
+        dead_idx = np.flatnonzero(dead)
+        if not len(dead_idx):
+            return
+        new_count = n - len(dead_idx)
+        holes = dead_idx[dead_idx < new_count]
+        fillers = np.flatnonzero(~dead[new_count:]) + new_count
+        for arr in self._arrays:
+            arr[holes] = arr[fillers]
+        self.count = new_count
+
+    def clear(self):
+        self.count = 0
+
+def sweep_circles(x0, y0, dx, dy, cx, cy, radius):
+    """Fraction (0..1) along each segment (x0, y0) + t * (dx, dy) where it first
+    touches a circle, or inf if it misses. Arguments broadcast like NumPy arrays."""
+    fx = x0 - cx
+    fy = y0 - cy
+    a = dx * dx + dy * dy
+    b = fx * dx + fy * dy
+    c = fx * fx + fy * fy - radius * radius
+    disc = b * b - a * c
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = (-b - np.sqrt(np.maximum(disc, 0))) / a
+    t = np.where((disc >= 0) & (t >= 0) & (t <= 1), t, np.inf)
+    # Segments that start inside the circle hit immediately
+    return np.where(c < 0, 0.0, t)
+
+def sweep_rects(x0, y0, dx, dy, left, top, right, bottom):
+    """Fraction (0..1) along each segment where it first enters an axis-aligned
+    rect, or inf if it misses (slab test). Arguments broadcast like NumPy arrays."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tx1 = (left - x0) / dx
+        tx2 = (right - x0) / dx
+        ty1 = (top - y0) / dy
+        ty2 = (bottom - y0) / dy
+    # A segment parallel to a slab is either always or never inside it
+    inside_x = (x0 >= left) & (x0 < right)
+    inside_y = (y0 >= top) & (y0 < bottom)
+    enter_x = np.where(dx == 0, np.where(inside_x, -np.inf, np.inf), np.minimum(tx1, tx2))
+    exit_x = np.where(dx == 0, np.where(inside_x, np.inf, -np.inf), np.maximum(tx1, tx2))
+    enter_y = np.where(dy == 0, np.where(inside_y, -np.inf, np.inf), np.minimum(ty1, ty2))
+    exit_y = np.where(dy == 0, np.where(inside_y, np.inf, -np.inf), np.maximum(ty1, ty2))
+    enter = np.maximum(np.maximum(enter_x, enter_y), 0)
+    leave = np.minimum(np.minimum(exit_x, exit_y), 1)
+    return np.where(enter <= leave, enter, np.inf)
+
+TRAIL_LENGTH = 15
+TRAIL_WIDTHS = (2, 5, 8)  # line width of each trail segment, tail to head
+BULLET_HEAD_RADIUS = 7
+MAX_BULLETS = 4096
+
+class BulletPool(ArrayPool):
+    """Fixed-capacity, struct-of-arrays store for every bullet in flight.
+
+    Slots [0, count) are live. Shooting writes into the next free slot and dead
+    bullets are swap-removed with the tail, so nothing is allocated per shot and
+    movement, culling and hit tests each run as a handful of array operations.
+    Bullets fly in straight lines, so trails are derived from velocity and age
+    instead of being stored. Velocities are in pixels per second and ages in
+    seconds, so the pool works at any simulation rate.
+    """
+    def __init__(self, capacity=MAX_BULLETS):
+        super().__init__(capacity)
+        self.x = self._field()
+        self.y = self._field()
+        self.vx = self._field()
+        self.vy = self._field()
+        self.damage = self._field(np.int32)
+        self.owner = self._field(np.int8)   # index into the player list
+        self.weapon = self._field(np.int8)  # WEAPONS key, for drawing
+        self.age = self._field()            # seconds since fired
+
+    def spawn(self, x, y, angle, speed, damage, owner, weapon):
+        """Fire a bullet; returns False if the pool is full and the shot was dropped"""
+        i = self.count
+        if i >= self.capacity:
+            return False
+        self.x[i] = x
+        self.y[i] = y
+        self.vx[i] = math.cos(angle) * speed
+        self.vy[i] = math.sin(angle) * speed
+        self.damage[i] = damage
+        self.owner[i] = owner
+        self.weapon[i] = weapon
+        self.age[i] = 0
+        self.count = i + 1
+        return True
+
+    def move(self, dt):
+        n = self.count
+        self.x[:n] += self.vx[:n] * dt
+        self.y[:n] += self.vy[:n] * dt
+        self.age[:n] += dt
+
+    def out_of_bounds(self, width, height):
+        """Mask of live bullets outside the arena (which may be far bigger than the screen)"""
+        n = self.count
+        x = self.x[:n]
+        y = self.y[:n]
+        return (x < 0) | (x > width) | (y < 0) | (y > height)
+
+    def path(self, dt):
+        """Segment each live bullet covered during its last move(dt), as
+        (x0, y0, dx, dy) arrays"""
+        n = self.count
+        dx = self.vx[:n] * dt
+        dy = self.vy[:n] * dt
+        return self.x[:n] - dx, self.y[:n] - dy, dx, dy
+
+    def hits(self, px, py, radius, dt):
+        """Swept hit test of every live bullet's last move against the players.
 
-    def move(self):
-        self.x += math.cos(self.angle) * self.speed
-        self.y += math.sin(self.angle) * self.speed
-        # Store trail points for visual effect
-        self.trail_points.append((self.x, self.y))
-        if len(self.trail_points) > 15:
-            self.trail_points.pop(0)
+        px, py and radius are arrays with one entry per player; a bullet never
+        hits the player who fired it, or a player with a radius of 0 (the
+        dead). Returns, per bullet, the index of the first player its path
+        touched (or -1) and how far along the path that happened (or inf).
+        """
+        n = self.count
+        x0, y0, dx, dy = self.path(dt)
+        t = sweep_circles(x0, y0, dx, dy, px[:, None], py[:, None], radius[:, None])
+        t[(self.owner[:n] == np.arange(len(px))[:, None]) | (radius[:, None] <= 0)] = np.inf
+        first = t.argmin(axis=0)
+        t_hit = t[first, np.arange(n)]
+        return np.where(np.isfinite(t_hit), first, -1), t_hit
+
+    def draw(self, lag=0.0):
+        """Draw every bullet lag seconds back along its path (for interpolation)
+        and return the screen area each one covered.
+
+        A trail is a few line segments getting thicker toward the head, one
+        per TRAIL_WIDTHS entry, and the head is a cached sprite, so each
+        bullet costs len(TRAIL_WIDTHS) + 1 draw calls whatever the trail
+        length. The geometry for all bullets is worked out in one batch, and
+        bullets wholly out of view are skipped.
+        """
+        n = self.count
+        if not n:
+            return []
+        vx, vy = self.vx[:n], self.vy[:n]
+        x = self.x[:n] - vx * lag - view_offset[0]
+        y = self.y[:n] - vy * lag - view_offset[1]
+        # Trail points are one BASE_RATE frame apart, so the tail is length - 1 frames back
+        length = np.minimum((self.age[:n] * BASE_RATE + 0.5).astype(np.int32), quality.trail_length)
+        back = np.maximum(length - 1, 0) / BASE_RATE
+        tail_x = x - vx * back
+        tail_y = y - vy * back
+        margin = BULLET_HEAD_RADIUS + 1
+        visible = ((np.maximum(x, tail_x) > -margin) & (np.minimum(x, tail_x) < WIDTH + margin) &
+                   (np.maximum(y, tail_y) > -margin) & (np.minimum(y, tail_y) < HEIGHT + margin))
+        if not visible.all():
+            x, y, tail_x, tail_y, length = x[visible], y[visible], tail_x[visible], tail_y[visible], length[visible]
+            weapons = self.weapon[:n][visible]
+        else:
+            weapons = self.weapon[:n]
+        segments = len(TRAIL_WIDTHS)
+        # Segment k runs from fraction k / segments of the way from tail to head
+        # to (k + 1) / segments
+        steps = np.arange(segments + 1) / segments
+        points_x = (tail_x[:, None] + (x - tail_x)[:, None] * steps).tolist()
+        points_y = (tail_y[:, None] + (y - tail_y)[:, None] * steps).tolist()
+        left = (np.minimum(x, tail_x).astype(np.int32) - 8).tolist()
+        top = (np.minimum(y, tail_y).astype(np.int32) - 8).tolist()
+        right = (np.maximum(x, tail_x).astype(np.int32) + 9).tolist()
+        bottom = (np.maximum(y, tail_y).astype(np.int32) + 9).tolist()
+        heads = [bullet_head(weapon) for weapon in range(len(WEAPONS))]
+        draw_line = pygame.draw.line
+        blit = screen.blit
+
+        bounds = []
+        for i, (head_x, head_y, trail, weapon) in enumerate(zip(x.astype(np.int32).tolist(),
+                                                                y.astype(np.int32).tolist(),
+                                                                (length > 1).tolist(),
+                                                                weapons.tolist())):
+            if trail:
+                color = WEAPONS[weapon]["color"]
+                px, py = points_x[i], points_y[i]
+                for k, width in enumerate(TRAIL_WIDTHS):
+                    draw_line(screen, color, (px[k], py[k]), (px[k + 1], py[k + 1]), width)
+            blit(heads[weapon], (head_x - BULLET_HEAD_RADIUS, head_y - BULLET_HEAD_RADIUS))
+            bounds.append(pygame.Rect(left[i], top[i], right[i] - left[i], bottom[i] - top[i]))
+        return bounds
+
+def bullet_head(weapon):
+    """The bullet's glowing head, pre-rendered per weapon"""
+    def render():
+        size = BULLET_HEAD_RADIUS * 2 + 1
+        center = (BULLET_HEAD_RADIUS, BULLET_HEAD_RADIUS)
+        color = WEAPONS[weapon]["color"]
+        surface = pygame.Surface((size, size)).convert()
+        surface.fill(COLORKEY)
+        surface.set_colorkey(COLORKEY, pygame.RLEACCEL)
+        pygame.draw.circle(surface, color, center, BULLET_HEAD_RADIUS)
+        pygame.draw.circle(surface, WHITE, center, 5)
+        pygame.draw.circle(surface, color, center, 3)
+        return surface
+    return surface_cache.get(("bullet_head", weapon, WEAPONS[weapon]["color"]), render)
+
+MAX_PARTICLES = 8192
+PARTICLE_GRAVITY = 360  # px/s^2 (0.1 px per frame per frame at 60 FPS)
+
+class ParticlePool(ArrayPool):
+    """Capped pool of short-lived visual particles (hit sparks, muzzle flashes).
+
+    Position, velocity, gravity and lifetime are integrated for every live
+    particle with a few array operations per frame. Particles shrink from a
+    3px to a 1px radius over their life and are drawn in one Surface.blits()
+    call from pre-rendered sprites per color and radius. Emitting into a full
+    pool drops the overflow.
+    """
+    def __init__(self, capacity=MAX_PARTICLES, seed=None):
+        super().__init__(capacity)
+        self.x = self._field()
+        self.y = self._field()
+        self.vx = self._field()
+        self.vy = self._field()
+        self.life = self._field()      # seconds left
+        self.max_life = self._field()
+        self.color = self._field(np.int16)  # index into self.colors
+        self.colors = []
+        self.color_ids = {}
+        self.rng = np.random.default_rng(seed)
+
+    def emit(self, x, y, count, color, speed, lifetime, angle=0.0, spread=2 * math.pi):
+        """Burst of particles from (x, y), with directions within spread of angle
+        and speeds and lifetimes varying up to 50% below the given values"""
+        start = self.count
+        count = min(count, self.capacity - start)
+        if count <= 0:
+            return
+        end = start + count
+        if color not in self.color_ids:
+            self.color_ids[color] = len(self.colors)
+            self.colors.append(color)
+
+        rng = self.rng
+        directions = angle + (rng.random(count) - 0.5) * spread
+        speeds = speed * (0.5 + 0.5 * rng.random(count))
+        self.x[start:end] = x
+        self.y[start:end] = y
+        self.vx[start:end] = np.cos(directions) * speeds
+        self.vy[start:end] = np.sin(directions) * speeds
+        self.life[start:end] = lifetime * (0.5 + 0.5 * rng.random(count))
+        self.max_life[start:end] = self.life[start:end]
+        self.color[start:end] = self.color_ids[color]
+        self.count = end
+
+    def update(self, dt):
+        n = self.count
+        if not n:
+            return
+        self.x[:n] += self.vx[:n] * dt
+        self.y[:n] += self.vy[:n] * dt
+        self.vy[:n] += PARTICLE_GRAVITY * dt
+        self.life[:n] -= dt
+        self.remove(self.life[:n] <= 0)
+
+    def _sprite(self, color_id, radius):
+        color = self.colors[color_id]
+        def render():
+            surface = pygame.Surface((radius * 2 + 1, radius * 2 + 1)).convert()
+            surface.fill(COLORKEY)
+            surface.set_colorkey(COLORKEY, pygame.RLEACCEL)
+            pygame.draw.circle(surface, color, (radius, radius), radius)
+            return surface
+        return surface_cache.get(("particle", color, radius), render)
 
     def draw(self):
-        # Draw trail
-        for i, point in enumerate(self.trail_points):
-            alpha = int(255 * (i / max(1, len(self.trail_points))))
-            size = max(1, int(5 * (i / max(1, len(self.trail_points)))))
-            pygame.draw.circle(screen, self.color, (int(point[0]), int(point[1])), size)
-        
-        # Draw bullet with enhanced glow
-        pygame.draw.circle(screen, self.color, (int(self.x), int(self.y)), 7)
-        pygame.draw.circle(screen, WHITE, (int(self.x), int(self.y)), 5)
-        pygame.draw.circle(screen, self.color, (int(self.x), int(self.y)), 3)
+        """Draw every live particle in view and return the screen area they cover"""
+        n = self.count
+        if not n:
+            return []
+        radius = np.maximum(1, (3 * self.life[:n] / self.max_life[:n]).astype(np.int64))
+        left = (self.x[:n] - view_offset[0]).astype(np.int64) - radius
+        top = (self.y[:n] - view_offset[1]).astype(np.int64) - radius
+        color = self.color[:n]
+        visible = (left > -2 * radius) & (left < WIDTH) & (top > -2 * radius) & (top < HEIGHT)
+        if not visible.all():
+            if not visible.any():
+                return []
+            radius, left, top, color = radius[visible], left[visible], top[visible], color[visible]
+        sprites = {}
+        batch = []
+        for color_id, r, x, y in zip(color.tolist(), radius.tolist(), left.tolist(), top.tolist()):
+            key = (color_id, r)
+            sprite = sprites.get(key)
+            if sprite is None:
+                sprite = sprites[key] = self._sprite(color_id, r)
+            batch.append((sprite, (x, y)))
+        screen.blits(batch, False)
+        x0, y0 = int(left.min()), int(top.min())
+        return [pygame.Rect(x0, y0, int((left + 2 * radius).max()) + 1 - x0, int((top + 2 * radius).max()) + 1 - y0)]
+
+particles = ParticlePool()
 
-    def off_screen(self):
-        return self.x < 0 or self.x > WIDTH or self.y < 0 or self.y > HEIGHT
+def spawn_effects(events):
+    """Muzzle flashes for shots and sparks for hits"""
+    for kind, player in events:
+        if kind == "shoot":
+            color = WEAPONS[player.weapon]["color"]
+            muzzle_x = player.x + math.cos(player.angle) * (player.radius + 12)
+            muzzle_y = player.y + math.sin(player.angle) * (player.radius + 12)
+            particles.emit(muzzle_x, muzzle_y, 6, color, 240, 0.15, player.angle, 0.8)
+        elif kind == "hit":
+            particles.emit(player.x, player.y, 16, WHITE, 300, 0.5)
+            particles.emit(player.x, player.y, 8, player.color, 200, 0.4)
 
 
 class Obstacle:
@@ -242,12 +1084,15 @@ class Obstacle:
         self.height = height
         self.rect = pygame.Rect(x, y, width, height)
     
-    def draw(self):
+    def draw(self, surface=None, offset=(0, 0)):
+        if surface is None:
+            surface = screen
+        rect = self.rect.move(-offset[0], -offset[1])
         # Draw obstacle with glowing effect
-        glow_rect = self.rect.inflate(8, 8)
-        pygame.draw.rect(screen, (100, 50, 200), glow_rect)
-        pygame.draw.rect(screen, (150, 100, 255), self.rect)
-        pygame.draw.rect(screen, CYAN, self.rect, 3)
+        glow_rect = rect.inflate(8, 8)
+        pygame.draw.rect(surface, (100, 50, 200), glow_rect)
+        pygame.draw.rect(surface, (150, 100, 255), rect)
+        pygame.draw.rect(surface, CYAN, rect, 3)
     
     def collides_with_circle(self, x, y, radius):
         """Check if obstacle collides with a circle (player)"""
@@ -264,34 +1109,739 @@ class Obstacle:
         return self.rect.collidepoint(x, y)
 
 
-def draw_background():
-    global camera_offset
-    
-    screen.fill(BLACK)
-    
-    # Moving grid background based on camera offset
-    grid_size = 50
-    offset_x = int(camera_offset[0]) % grid_size
-    offset_y = int(camera_offset[1]) % grid_size
-    
-    # Draw vertical lines
-    for i in range(-1, WIDTH // grid_size + 2):
-        x = i * grid_size - offset_x
-        pygame.draw.line(screen, (30, 30, 35), (x, 0), (x, HEIGHT), 1)
-    
-    # Draw horizontal lines
-    for j in range(-1, HEIGHT // grid_size + 2):
-        y = j * grid_size - offset_y
-        pygame.draw.line(screen, (30, 30, 35), (0, y), (WIDTH, y), 1)
+def generate_obstacles(rng, count, width, height):
+    """Scatter random obstacles across the arena"""
+    obstacles = []
+    for i in range(count):
+        x = rng.randint(100, width - 100)
+        y = rng.randint(100, height - 100)
+        w = rng.randint(40, 100)
+        h = rng.randint(40, 100)
+        obstacles.append(Obstacle(x, y, w, h))
+    return obstacles
+
+
+OBSTACLE_CELL_SIZE = 100
+
+class ObstacleGrid:
+    """Uniform-grid spatial index over the (static) obstacles of an arena.
+
+    Each cell lists the obstacles whose rect overlaps it, so collision queries
+    only test the obstacles near the query instead of all of them. Cells are
+    also flattened into CSR arrays (cell_start / cell_items) for the batched
+    bullet query.
+    """
+    def __init__(self, obstacles, width, height, cell_size=OBSTACLE_CELL_SIZE):
+        self.obstacles = obstacles
+        self.cell_size = cell_size
+        self.cols = width // cell_size + 1
+        self.rows = height // cell_size + 1
+        self.cells = [[] for _ in range(self.cols * self.rows)]
+        for obstacle in obstacles:
+            for cell in self._cells_in(obstacle.rect.left, obstacle.rect.top,
+                                       obstacle.rect.right, obstacle.rect.bottom):
+                self.cells[cell].append(obstacle)
+
+        index = {id(obstacle): i for i, obstacle in enumerate(obstacles)}
+        self.cell_start = np.zeros(len(self.cells) + 1, dtype=np.int64)
+        self.cell_start[1:] = np.cumsum([len(cell) for cell in self.cells])
+        self.cell_items = np.array([index[id(o)] for cell in self.cells for o in cell], dtype=np.int64)
+        self.left = np.array([o.rect.left for o in obstacles])
+        self.top = np.array([o.rect.top for o in obstacles])
+        self.right = np.array([o.rect.right for o in obstacles])
+        self.bottom = np.array([o.rect.bottom for o in obstacles])
+
+    def _cells_in(self, left, top, right, bottom):
+        size = self.cell_size
+        col0 = max(0, min(self.cols - 1, int(left // size)))
+        col1 = max(0, min(self.cols - 1, int(right // size)))
+        row0 = max(0, min(self.rows - 1, int(top // size)))
+        row1 = max(0, min(self.rows - 1, int(bottom // size)))
+        for row in range(row0, row1 + 1):
+            for col in range(col0, col1 + 1):
+                yield row * self.cols + col
+
+    def near_circle(self, x, y, radius):
+        """Obstacles in the cells a circle overlaps (may repeat)"""
+        for cell in self._cells_in(x - radius, y - radius, x + radius, y + radius):
+            yield from self.cells[cell]
+
+    def in_rect(self, rect):
+        """Obstacles overlapping rect, each once, looking only at the cells it covers"""
+        found = {}
+        for cell in self._cells_in(rect.left, rect.top, rect.right, rect.bottom):
+            for obstacle in self.cells[cell]:
+                if obstacle.rect.colliderect(rect):
+                    found[id(obstacle)] = obstacle
+        return list(found.values())
+
+    def circle_blocked(self, x, y, radius):
+        for obstacle in self.near_circle(x, y, radius):
+            if obstacle.collides_with_circle(x, y, radius):
+                return True
+        return False
+
+    def sweep(self, x0, y0, dx, dy):
+        """Fraction along each segment (arrays) where it first enters an
+        obstacle, or inf. Only obstacles in the cells covered by a segment's
+        bounding box are tested."""
+        n = len(x0)
+        t = np.full(n, np.inf)
+        if not n or not len(self.cell_items):
+            return t
+        if len(self.obstacles) <= 16:
+            # Testing a handful of obstacles directly beats the cell lookup
+            return sweep_rects(x0, y0, dx, dy, self.left[:, None], self.top[:, None],
+                               self.right[:, None], self.bottom[:, None]).min(axis=0)
+
+        # Cell range covered by each segment's bounding box
+        x1 = x0 + dx
+        y1 = y0 + dy
+        col0 = np.clip(np.minimum(x0, x1) // self.cell_size, 0, self.cols - 1).astype(np.int64)
+        col1 = np.clip(np.maximum(x0, x1) // self.cell_size, 0, self.cols - 1).astype(np.int64)
+        row0 = np.clip(np.minimum(y0, y1) // self.cell_size, 0, self.rows - 1).astype(np.int64)
+        row1 = np.clip(np.maximum(y0, y1) // self.cell_size, 0, self.rows - 1).astype(np.int64)
+        span = col1 - col0 + 1
+
+        # One (segment, cell) pair per covered cell
+        cell_counts = span * (row1 - row0 + 1)
+        segment = np.repeat(np.arange(n), cell_counts)
+        k = np.arange(len(segment)) - np.repeat(np.cumsum(cell_counts) - cell_counts, cell_counts)
+        cell = (row0[segment] + k // span[segment]) * self.cols + col0[segment] + k % span[segment]
+
+        # One (segment, candidate obstacle) pair per obstacle listed in those cells
+        start = self.cell_start[cell]
+        counts = self.cell_start[cell + 1] - start
+        total = int(counts.sum())
+        if not total:
+            return t
+        segment = np.repeat(segment, counts)
+        run_start = np.repeat(np.cumsum(counts) - counts, counts)
+        candidate = self.cell_items[np.arange(total) - run_start + np.repeat(start, counts)]
+        t_pair = sweep_rects(x0[segment], y0[segment], dx[segment], dy[segment],
+                             self.left[candidate], self.top[candidate],
+                             self.right[candidate], self.bottom[candidate])
+        np.minimum.at(t, segment, t_pair)
+        return t
+
+ARENA_VERSION = 1
+SPAWN_CLEARANCE = 10  # px of free space around a player at a spawn point
+REACH_CELL = 10       # px per cell of the spawn reachability check
+ARENA_ATTEMPTS = 100  # layouts generate_arena() tries before giving up
+
+class Arena:
+    """An arena layout and everything precomputed from it.
+
+    Building one indexes the obstacles in an ObstacleGrid for bullet sweeps and
+    rasterizes a bitmask of every pixel a player's center can't occupy, packed
+    eight pixels to a byte, so a movement check is a single lookup. spawns maps
+    each player count to its spawn points. Layouts come from load_arena() or
+    generate_arena(), which both reject anything problems() complains about;
+    files and seeded layouts are cached in arena_cache so a new match on the
+    same layout starts instantly.
+    """
+    def __init__(self, width, height, obstacles, spawns=None, name=None, radius=PLAYER_RADIUS):
+        self.width = width
+        self.height = height
+        self.obstacles = obstacles
+        self.name = name
+        self.radius = radius
+        self.grid = ObstacleGrid(obstacles, width, height)
+        self.blocked_mask = self._blocked_mask()
+        spawns = spawns or {}
+        self.spawns = {count: [tuple(point) for point in spawns.get(count) or spawn_points(count, width, height)]
+                       for count in range(MIN_PLAYERS, MAX_PLAYERS + 1)}
+
+    def _blocked_mask(self):
+        """A set bit wherever a player centered on that pixel would touch an
+        obstacle, one row of packed bits per pixel row"""
+        mask = np.zeros((self.height, self.width), dtype=bool)
+        r = self.radius
+        for obstacle in self.obstacles:
+            rect = obstacle.rect
+            x0, x1 = max(0, rect.left - r), min(self.width, rect.right + r + 1)
+            y0, y1 = max(0, rect.top - r), min(self.height, rect.bottom + r + 1)
+            if x0 >= x1 or y0 >= y1:
+                continue
+            xs = np.arange(x0, x1)
+            ys = np.arange(y0, y1)
+            # Distance to the closest point of the rect, as in collides_with_circle
+            dx = xs - np.clip(xs, rect.left, rect.right)
+            dy = ys - np.clip(ys, rect.top, rect.bottom)
+            mask[y0:y1, x0:x1] |= dy[:, None] ** 2 + dx[None, :] ** 2 < r * r
+        return np.packbits(mask, axis=1)
+
+    def circle_blocked(self, x, y, radius):
+        if radius == self.radius:
+            col, row = int(x), int(y)
+            if 0 <= row < self.height and 0 <= col < self.width:
+                return bool(self.blocked_mask[row, col >> 3] >> (7 - (col & 7)) & 1)
+        return self.grid.circle_blocked(x, y, radius)
+
+    def spawn_blocked(self, x, y):
+        r = self.radius + SPAWN_CLEARANCE
+        return (x < r or y < r or x > self.width - r or y > self.height - r or
+                self.grid.circle_blocked(x, y, r))
+
+    def _reachable(self):
+        """Coarse REACH_CELL grid of where a player can walk to from the first
+        open spawn point, by flood fill over the bitmask"""
+        half = REACH_CELL // 2
+        rows = np.unpackbits(self.blocked_mask[half::REACH_CELL], axis=1, count=self.width)
+        free = ~rows[:, half::REACH_CELL].astype(bool)
+        region = np.zeros_like(free)
+        open_spawns = [point for points in self.spawns.values() for point in points
+                       if not self.spawn_blocked(*point)]
+        if not open_spawns:
+            return region
+        x, y = open_spawns[0]
+        region[min(int(y) // REACH_CELL, free.shape[0] - 1), min(int(x) // REACH_CELL, free.shape[1] - 1)] = True
+        region &= free
+        while True:
+            grown = region.copy()
+            grown[1:] |= region[:-1]
+            grown[:-1] |= region[1:]
+            grown[:, 1:] |= region[:, :-1]
+            grown[:, :-1] |= region[:, 1:]
+            grown &= free
+            if (grown == region).all():
+                return region
+            region = grown
+
+    def problems(self):
+        """Everything wrong with the layout, as messages (empty if it's playable)"""
+        problems = []
+        bounds = pygame.Rect(0, 0, self.width, self.height)
+        for i, obstacle in enumerate(self.obstacles):
+            rect = obstacle.rect
+            if rect.width <= 0 or rect.height <= 0 or not bounds.contains(rect):
+                problems.append(f"obstacle {tuple(rect)} is empty or outside the arena")
+            for other in self.obstacles[:i]:
+                if rect.colliderect(other.rect):
+                    problems.append(f"obstacles {tuple(other.rect)} and {tuple(rect)} overlap")
+
+        region = self._reachable()
+        rows, cols = region.shape
+        for count, points in self.spawns.items():
+            if len(points) != count:
+                problems.append(f"{count}-player spawns list {len(points)} points")
+            for i, (x, y) in enumerate(points):
+                for ox, oy in points[:i]:
+                    if math.hypot(x - ox, y - oy) < 2 * self.radius:
+                        problems.append(f"{count}-player spawn points ({ox}, {oy}) and ({x}, {y}) overlap")
+            for x, y in points:
+                row, col = int(y) // REACH_CELL, int(x) // REACH_CELL
+                if self.spawn_blocked(x, y):
+                    problems.append(f"{count}-player spawn point ({x}, {y}) is blocked")
+                elif not region[max(0, row - 1):min(rows, row + 2), max(0, col - 1):min(cols, col + 2)].any():
+                    problems.append(f"{count}-player spawn point ({x}, {y}) can't be reached from the others")
+        return problems
 
-def draw_weapon_ui(player, x_offset):
+    def to_json(self):
+        return json.dumps({"version": ARENA_VERSION, "name": self.name,
+                           "width": self.width, "height": self.height,
+                           "obstacles": [list(obstacle.rect) for obstacle in self.obstacles],
+                           "spawns": {str(count): [list(point) for point in points]
+                                      for count, points in self.spawns.items()}})
+
+def _numbers(value, count, what):
+    """value as count ints, or ValueError if it isn't a list of that many
+    finite numbers (JSON lets Infinity and NaN through)"""
+    if (not isinstance(value, list) or len(value) != count or
+            not all(isinstance(n, (int, float)) and not isinstance(n, bool) and math.isfinite(n)
+                    for n in value)):
+        raise ValueError(f"{what} {value!r} is not a list of {count} finite numbers")
+    return [int(n) for n in value]
+
+def parse_arena(text, source="arena"):
+    """Arena from the JSON written by Arena.to_json(); raises ValueError if the
+    layout is malformed or unplayable. spawns may list any player counts (or
+    be left out); the others get the default spawn_points()."""
+    try:
+        data = json.loads(text)
+        if not isinstance(data, dict):
+            raise ValueError("not a JSON object")
+        if data.get("version", ARENA_VERSION) != ARENA_VERSION:
+            raise ValueError(f"version {data['version']}, expected {ARENA_VERSION}")
+        if not isinstance(data["obstacles"], list):
+            raise ValueError("obstacles is not a list")
+        obstacles = [Obstacle(*_numbers(rect, 4, "obstacle")) for rect in data["obstacles"]]
+        spawn_lists = data.get("spawns", {})
+        if not isinstance(spawn_lists, dict) or not all(isinstance(points, list) for points in spawn_lists.values()):
+            raise ValueError("spawns is not an object of point lists")
+        spawns = {int(count): [tuple(_numbers(point, 2, "spawn point")) for point in points]
+                  for count, points in spawn_lists.items()}
+        for count in spawns:
+            if not MIN_PLAYERS <= count <= MAX_PLAYERS:
+                raise ValueError(f"{count}-player spawns, but a match has {MIN_PLAYERS}-{MAX_PLAYERS} players")
+        width, height = int(data["width"]), int(data["height"])
+        if not (0 < width <= MAX_ARENA_SIZE[0] and 0 < height <= MAX_ARENA_SIZE[1]):
+            raise ValueError("size {}x{} is not between 1x1 and {}x{}".format(width, height, *MAX_ARENA_SIZE))
+        arena = Arena(width, height, obstacles, spawns, data.get("name"))
+        problems = arena.problems()
+    except (KeyError, TypeError, ValueError, OverflowError) as error:
+        raise ValueError(f"{source} is not a valid arena: {error}") from None
+    if problems:
+        raise ValueError(f"{source} is not a valid arena: " + "; ".join(problems))
+    return arena
+
+def read_arena(path):
+    with open(path) as f:
+        return parse_arena(f.read(), path)
+
+def load_arena(path):
+    """Arena from a file, cached until the file changes"""
+    key = ("file", os.path.abspath(path), os.path.getmtime(path))
+    return arena_cache.get(key, lambda: read_arena(path))
+
+def _generate_arena(seed, obstacle_count, width, height):
+    rng = random.Random(seed)
+    spawns = [point for count in range(MIN_PLAYERS, MAX_PLAYERS + 1)
+              for point in spawn_points(count, width, height)]
+    clearance = PLAYER_RADIUS + SPAWN_CLEARANCE
+    for _ in range(ARENA_ATTEMPTS):
+        obstacles = []
+        for _ in range(obstacle_count * 50):
+            if len(obstacles) == obstacle_count:
+                break
+            obstacle = generate_obstacles(rng, 1, width, height)[0]
+            # Obstacles may not touch each other or any spawn point
+            if (obstacle.rect.collidelist([other.rect for other in obstacles]) < 0 and
+                    not any(obstacle.collides_with_circle(x, y, clearance) for x, y in spawns)):
+                obstacles.append(obstacle)
+        if len(obstacles) < obstacle_count:
+            continue
+        arena = Arena(width, height, obstacles, name=f"generated {seed}")
+        if not arena.problems():
+            return arena
+    raise ValueError(f"no valid {width}x{height} arena with {obstacle_count} obstacles after "
+                     f"{ARENA_ATTEMPTS} attempts")
+
+def generate_arena(seed=None, obstacle_count=8, width=None, height=None, cache=True):
+    """Seeded random layout, redrawn until it passes Arena.problems(); cached
+    unless seed is None or cache is False (for one-off per-match seeds)"""
+    width = width or WIDTH
+    height = height or HEIGHT
+    if seed is None:
+        seed = random.random()
+        cache = False
+    if not cache:
+        return _generate_arena(seed, obstacle_count, width, height)
+    key = ("generated", seed, obstacle_count, width, height)
+    return arena_cache.get(key, lambda: _generate_arena(seed, obstacle_count, width, height))
+
+arena_cache = SurfaceCache(capacity=8)  # the LRU works for arenas as well as surfaces
+
+MAX_ARENA_SIZE = (8000, 8000)  # the blocked-cell bitmask takes a bit per pixel
+
+def fit_obstacles(width, height):
+    """How many obstacles a generated arena of this size gets: 8 per 1200x700,
+    the density of the original arena"""
+    return max(8, round(8 * width * height / (1200 * 700)))
+
+
+class PlayerInput:
+    """What one player asked for during one tick, whatever device it came from"""
+    def __init__(self, move_x=0, move_y=0, aim_point=None, aim_stick=None,
+                 fire=False, weapon=None, cycle=0):
+        self.move_x = move_x        # -1..1, scaled by PLAYER_SPEED
+        self.move_y = move_y
+        self.aim_point = aim_point  # absolute target to aim at (mouse)
+        self.aim_stick = aim_stick  # stick direction, smoothed toward (controller)
+        self.fire = fire
+        self.weapon = weapon        # select a weapon directly, or None
+        self.cycle = cycle          # -1 / 0 / +1 to step through weapons
+
+
+class ArenaSimulation:
+    """Rules and state for a single match, with no rendering and no frame cap.
+
+    step() advances the match by one fixed tick of 1 / tick_rate seconds and
+    returns the events ("shoot", "hit", "switch") that happened during it, so the
+    caller can decide what to draw and play; shots lists who fired what for
+    each "shoot" (a player can switch away on the same tick) and hits who hit
+    whom with what for each "hit". The match is played on arena, or
+    if that's None on the layout generate_arena() makes from seed,
+    obstacle_count, width and height (not cached, since a match's seed is
+    usually its own).
+    """
+    def __init__(self, width=None, height=None, seed=None, obstacle_count=8,
+                 bullet_capacity=MAX_BULLETS, tick_rate=SIM_RATE, player_count=2, arena=None):
+        if not MIN_PLAYERS <= player_count <= MAX_PLAYERS:
+            raise ValueError(f"player_count must be {MIN_PLAYERS}-{MAX_PLAYERS}, not {player_count}")
+        self.arena = arena or generate_arena(seed, obstacle_count, width, height, cache=False)
+        self.width = self.arena.width
+        self.height = self.arena.height
+        self.players = [Player(x, y, PLAYER_COLORS[i], f"P{i + 1}")
+                        for i, (x, y) in enumerate(self.arena.spawns[player_count])]
+        self.bullets = BulletPool(bullet_capacity)
+        self.obstacles = self.arena.obstacles
+        self.obstacle_grid = self.arena.grid
+        self.tick_rate = tick_rate
+        self.dt = 1 / tick_rate
+        self.frame_scale = BASE_RATE / tick_rate  # BASE_RATE frames per tick
+        self.time = 0  # simulated milliseconds
+        self.ticks = 0
+        self.events = []
+        self.shots = []  # (shooter, weapon) for each "shoot" event
+        self.hits = []  # (target, shooter, weapon, damage) for each "hit" event
+        self.winner = None
+        self.winner_color = WHITE
+
+    def step(self, inputs):
+        self.time += 1000 * self.dt
+        self.ticks += 1
+        self.events = []
+        self.shots = []
+        self.hits = []
+        for player in self.players:
+            player.prev_x, player.prev_y, player.prev_angle = player.x, player.y, player.angle
+
+        for index, player_input in enumerate(inputs):
+            self.apply_input(index, player_input)
+        profiler.lap("players")
+        self.update_bullets()
+
+        # Last one standing wins; if the last few fall on the same tick, nobody does
+        alive = [i for i, player in enumerate(self.players) if player.hp > 0]
+        if len(alive) == 1:
+            self.winner = f"PLAYER {alive[0] + 1}"
+            self.winner_color = self.players[alive[0]].color
+        elif not alive:
+            self.winner = "NOBODY"
+        return self.events
+
+    def apply_input(self, index, player_input):
+        player = self.players[index]
+        if player.hp <= 0:
+            return
+
+        # Movement - check collisions BEFORE moving
+        speed = PLAYER_SPEED * self.frame_scale
+        new_x = max(5, min(self.width - 5, player.x + player_input.move_x * speed))
+        new_y = max(5, min(self.height - 5, player.y + player_input.move_y * speed))
+        if not self.blocked(new_x, new_y, player.radius):
+            player.x = new_x
+            player.y = new_y
+
+        # Aim
+        if player_input.aim_point is not None:
+            player.angle = math.atan2(player_input.aim_point[1] - player.y,
+                                      player_input.aim_point[0] - player.x)
+        elif player_input.aim_stick is not None:
+            rx, ry = player_input.aim_stick
+            # Reduced aim sensitivity for finer angle control with proper 360 wrapping
+            if abs(rx) > 0.2 or abs(ry) > 0.2:
+                angle_diff = normalize_angle_diff(math.atan2(ry, rx), player.angle)
+                player.angle += angle_diff * (1 - 0.85 ** self.frame_scale)
+
+        # Shoot
+        if player_input.fire:
+            weapon = WEAPONS[player.weapon]
+            if self.time - player.last_shot > weapon["delay"]:
+                self.bullets.spawn(player.x, player.y, player.angle,
+                                   weapon["speed"] * BASE_RATE, weapon["damage"], index, player.weapon)
+                self.events.append(("shoot", player))
+                self.shots.append((index, player.weapon))
+                player.last_shot = self.time
+
+        # Weapon switch
+        if player_input.weapon is not None:
+            player.weapon = player_input.weapon
+            self.events.append(("switch", player))
+        elif player_input.cycle and self.time - player.last_weapon_switch > WEAPON_SWITCH_DEBOUNCE:
+            player.weapon = (player.weapon + player_input.cycle) % len(WEAPONS)
+            player.last_weapon_switch = self.time
+            self.events.append(("switch", player))
+
+    def blocked(self, x, y, radius):
+        return self.arena.circle_blocked(x, y, radius)
+
+    def snapshot(self):
+        """Copy of everything step() can change, for restore()"""
+        n = self.bullets.count
+        return (self.time, self.ticks, self.winner, self.winner_color,
+                [dict(player.__dict__) for player in self.players],
+                n, [arr[:n].copy() for arr in self.bullets._arrays])
+
+    def restore(self, snapshot):
+        """Rewind the match to a snapshot() taken earlier"""
+        self.time, self.ticks, self.winner, self.winner_color, players, n, arrays = snapshot
+        for player, saved in zip(self.players, players):
+            player.__dict__.update(saved)
+        for arr, saved in zip(self.bullets._arrays, arrays):
+            arr[:n] = saved
+        self.bullets.count = n
+        self.events = []
+        self.shots = []
+        self.hits = []
+
+    def digest(self):
+        """Short hash of the match state, for checking that two runs agree"""
+        h = hashlib.sha1()
+        for player in self.players:
+            h.update(struct.pack("<3di", player.x, player.y, player.angle, player.hp))
+        n = self.bullets.count
+        for arr in (self.bullets.x, self.bullets.y):
+            h.update(arr[:n].tobytes())
+        return h.hexdigest()[:12]
+
+    def update_bullets(self):
+        bullets = self.bullets
+        bullets.move(self.dt)
+        if not bullets.count:
+            profiler.lap("bullets")
+            return
+
+        players = self.players
+        px = np.array([player.x for player in players])
+        py = np.array([player.y for player in players])
+        radius = np.array([player.radius if player.hp > 0 else 0 for player in players], dtype=float)
+        # Sweep each bullet's path so fast projectiles can't tunnel through
+        # players or thin obstacles; whichever it reaches first stops it
+        targets, t_player = bullets.hits(px, py, radius, self.dt)
+        profiler.lap("bullets")
+        t_obstacle = self.obstacle_grid.sweep(*bullets.path(self.dt))
+        hit = (targets >= 0) & (t_player <= t_obstacle)
+        for i in np.flatnonzero(hit).tolist():
+            target = players[targets[i]]
+            target.hp -= int(bullets.damage[i])
+            self.events.append(("hit", target))
+            self.hits.append((int(targets[i]), int(bullets.owner[i]), int(bullets.weapon[i]),
+                              int(bullets.damage[i])))
+
+        dead = hit | np.isfinite(t_obstacle) | bullets.out_of_bounds(self.width, self.height)
+        bullets.remove(dead)
+        profiler.lap("obstacles")
+
+
+GRID_SIZE = 50
+GRID_COLOR = (30, 30, 35)
+COLORKEY = (255, 0, 255)
+
+class StaticLayer:
+    """Background grid and obstacles, pre-rendered and reused between frames.
+
+    The grid is drawn once onto a tile one cell larger than the screen, and the
+    obstacles once per layout onto a colorkeyed layer. The two are composed into
+    a screen-sized cache that is only rebuilt when the obstacle layout, the
+    grid phase from camera_offset or quality.grid_lines changes; otherwise
+    drawing the background is a single blit. With drift off the grid doesn't
+    follow the camera, so the cache stays put for as long as the layout does.
+
+    An arena bigger than the screen scrolls instead: the grid is fixed to the
+    world, and the cache is rebuilt whenever view_offset moves, from just the
+    obstacles the arena's ObstacleGrid finds in view.
+    """
+    def __init__(self):
+        self.size = None
+        self.grid_lines = None
+        self.grid = None
+        self.obstacles = None
+        self.obstacle_layer = None
+        self.surface = None
+        self.view = None     # grid phase, or scroll position, the cache was built for
+        self.changed = True  # whether the last get() rebuilt the cache
+
+    def _build(self, size, grid_lines):
+        width, height = size
+        self.size = size
+        self.grid_lines = grid_lines
+        self.grid = pygame.Surface((width + GRID_SIZE, height + GRID_SIZE)).convert()
+        self.grid.fill(BLACK)
+        if grid_lines:
+            # Draw vertical lines
+            for i in range(width // GRID_SIZE + 2):
+                x = i * GRID_SIZE
+                pygame.draw.line(self.grid, GRID_COLOR, (x, 0), (x, height + GRID_SIZE), 1)
+            # Draw horizontal lines
+            for j in range(height // GRID_SIZE + 2):
+                y = j * GRID_SIZE
+                pygame.draw.line(self.grid, GRID_COLOR, (0, y), (width + GRID_SIZE, y), 1)
+        self.surface = pygame.Surface(size).convert()
+        self.obstacles = None
+        self.view = None
+
+    def _build_obstacles(self, obstacles):
+        self.obstacles = obstacles
+        self.obstacle_layer = None
+        if obstacles:
+            self.obstacle_layer = pygame.Surface(self.size).convert()
+            self.obstacle_layer.fill(COLORKEY)
+            self.obstacle_layer.set_colorkey(COLORKEY)
+            for obstacle in obstacles:
+                obstacle.draw(self.obstacle_layer)
+        self.view = None
+
+    def get(self, arena=None, drift=True):
+        if screen.get_size() != self.size or quality.grid_lines != self.grid_lines:
+            self._build(screen.get_size(), quality.grid_lines)
+        obstacles = arena.obstacles if arena else ()
+        scrolling = arena is not None and (arena.width > self.size[0] or arena.height > self.size[1])
+
+        if scrolling:
+            if obstacles is not self.obstacles:
+                self.obstacles = obstacles
+                self.obstacle_layer = None
+                self.view = None
+            view = (int(view_offset[0]), int(view_offset[1]))
+            phase = (view[0] % GRID_SIZE, view[1] % GRID_SIZE) if self.grid_lines else (0, 0)
+        else:
+            if obstacles is not self.obstacles:
+                self._build_obstacles(obstacles)
+            # Moving grid background based on camera offset (a plain one doesn't move)
+            phase = (0, 0)
+            if self.grid_lines and drift:
+                phase = (int(camera_offset[0]) % GRID_SIZE, int(camera_offset[1]) % GRID_SIZE)
+            view = phase
+        self.changed = view != self.view
+        if self.changed:
+            self.view = view
+            self.surface.blit(self.grid, (-phase[0], -phase[1]))
+            if scrolling:
+                for obstacle in arena.grid.in_rect(pygame.Rect(view, self.size).inflate(8, 8)):
+                    obstacle.draw(self.surface, view)
+            elif self.obstacle_layer:
+                self.surface.blit(self.obstacle_layer, (0, 0))
+        return self.surface
+
+static_layer = StaticLayer()
+
+def draw_background(arena=None):
+    screen.blit(static_layer.get(arena), (0, 0))
+
+class Presenter:
+    """Pushes finished frames to the display.
+
+    With dirty_rects on, only the areas drawn this frame or the previous one
+    are erased (from the static layer) and sent to the display on their own.
+    The background grid doesn't drift with the camera then, since every
+    move would need a full frame; a background change that does happen, or a
+    frame where most of the screen moved anyway, falls back to a full redraw
+    and flip.
+    """
+    def __init__(self, dirty_rects=False):
+        self.dirty_rects = dirty_rects
+        self.previous = None  # rects drawn last frame; None forces a full frame
+        self.full = True
+
+    def begin(self, arena=None):
+        background = static_layer.get(arena, drift=not self.dirty_rects)
+        self.full = not self.dirty_rects or static_layer.changed or self.previous is None
+        if self.full:
+            screen.blit(background, (0, 0))
+        else:
+            for rect in self.previous:
+                screen.blit(background, rect, rect)
+
+    def end(self, rects):
+        if self.full or sum(r.w * r.h for r in rects) > screen.get_width() * screen.get_height() // 2:
+            present()
+        else:
+            present(self.previous + rects)
+        self.previous = rects if self.dirty_rects else None
+
+QUALITY_LEVELS = (
+    # name, player glow layers, bullet trail points, grid lines
+    ("high", True, TRAIL_LENGTH, True),
+    ("medium", True, 6, True),
+    ("low", False, 6, True),
+    ("minimal", False, 2, False),
+)
+
+class QualityGovernor:
+    """Trades drawing detail for frame time.
+
+    frame() is given how long each frame took to update and draw (not counting
+    the wait for the frame cap). Every window frames, if the 90th percentile is
+    over budget, detail drops one QUALITY_LEVELS step; once it has stayed under
+    headroom * budget for patience windows in a row, it comes back one step.
+    A level that goes straight back over budget after being restored waits
+    twice as long before it is tried again. With adaptive off the level stays
+    where it was set.
+    """
+    def __init__(self, budget=1 / FPS, window=30, headroom=0.6, patience=4):
+        self.budget = budget
+        self.window = window
+        self.headroom = headroom
+        self.patience = patience
+        self.adaptive = True
+        self.samples = []
+        self.calm = 0               # windows in a row with headroom
+        self.raised = False         # whether the last window restored detail
+        self.waits = [patience] * len(QUALITY_LEVELS)  # windows of headroom before restoring each level
+        self.changes = 0
+        self.set_level(0)
+
+    def set_level(self, level):
+        self.level = level
+        self.name, self.glow, self.trail_length, self.grid_lines = QUALITY_LEVELS[level]
+
+    def frame(self, seconds):
+        if not self.adaptive:
+            return
+        self.samples.append(seconds)
+        if len(self.samples) < self.window:
+            return
+        self.samples.sort()
+        slow = self.samples[len(self.samples) * 9 // 10]
+        self.samples.clear()
+        raised, self.raised = self.raised, False
+        if slow > self.budget and self.level < len(QUALITY_LEVELS) - 1:
+            if raised:
+                self.waits[self.level] *= 2
+            self.set_level(self.level + 1)
+            self.calm = 0
+            self.changes += 1
+        elif slow < self.budget * self.headroom and self.level > 0:
+            self.calm += 1
+            if self.calm >= self.waits[self.level - 1]:
+                self.set_level(self.level - 1)
+                self.calm = 0
+                self.raised = True
+                self.changes += 1
+        else:
+            self.calm = 0
+
+quality = QualityGovernor()
+
+WEAPON_UI_WIDTH = 340
+WEAPON_UI_MARGIN = 100
+
+def render_weapon_ui(selected, color=BLUE, width=WEAPON_UI_WIDTH):
+    # Per-pixel alpha rather than a colorkey, since smoothscale blends the key
+    # color into the edges of whatever it shrinks
+    surface = pygame.Surface((340, 30), pygame.SRCALPHA).convert_alpha()
+    surface.fill((0, 0, 0, 0))
     for i in range(3):
-        rect = pygame.Rect(x_offset + i*120, 10, 100, 30)
-        pygame.draw.rect(screen, GRAY, rect)
-        if i == player.weapon:
-            pygame.draw.rect(screen, BLUE, rect, 3)
-        text = font.render(WEAPONS[i]["name"], True, WHITE)
-        screen.blit(text, (rect.x + 10, rect.y + 5))
+        rect = pygame.Rect(i*120, 0, 100, 30)
+        pygame.draw.rect(surface, GRAY, rect)
+        if i == selected:
+            pygame.draw.rect(surface, color, rect, 3)
+        surface.blit(render_text(font, WEAPONS[i]["name"], WHITE), (rect.x + 10, rect.y + 5))
+    if width != surface.get_width():
+        surface = pygame.transform.smoothscale(surface, (width, round(30 * width / 340)))
+    return surface
+
+def weapon_ui_layout(count):
+    """Position and width of each player's weapon panel: spread along the top of
+    the screen, with a second row along the bottom for more than four players"""
+    rows = [range(count)] if count <= 4 else [range((count + 1) // 2), range((count + 1) // 2, count)]
+    layout = [None] * count
+    for row, players in enumerate(rows):
+        columns = len(players)
+        width = min(WEAPON_UI_WIDTH, (WIDTH - 2 * WEAPON_UI_MARGIN) // columns - 20)
+        span = WIDTH - 2 * WEAPON_UI_MARGIN - width
+        y = 10 if row == 0 else HEIGHT - 10 - round(30 * width / 340)
+        for column, index in enumerate(players):
+            x = WEAPON_UI_MARGIN + (span * column // (columns - 1) if columns > 1 else 0)
+            layout[index] = (x, y, width)
+    return layout
+
+def draw_weapon_ui(player, x_offset, y_offset=10, width=WEAPON_UI_WIDTH):
+    panel = surface_cache.get(("weapon_ui", player.weapon, player.color, width),
+                              lambda: render_weapon_ui(player.weapon, player.color, width))
+    return screen.blit(panel, (x_offset, y_offset))
 
 class Button:
     def __init__(self, x, y, width, height, text, color, text_color):
@@ -305,7 +1855,7 @@ class Button:
         color = tuple(min(255, c + 50) for c in self.color) if self.hover else self.color
         pygame.draw.rect(screen, color, self.rect)
         pygame.draw.rect(screen, self.text_color, self.rect, 3)
-        text_surf = menu_font.render(self.text, True, self.text_color)
+        text_surf = render_text(menu_font, self.text, self.text_color)
         text_rect = text_surf.get_rect(center=self.rect.center)
         screen.blit(text_surf, text_rect)
 
@@ -315,280 +1865,895 @@ class Button:
     def update_hover(self, pos):
         self.hover = self.rect.collidepoint(pos)
 
+IDLE_WAKE_MS = 500  # longest the menus sleep without any events
+REDRAW_EVENTS = (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED, pygame.WINDOWRESTORED, pygame.WINDOWSIZECHANGED)
+
+menu_frame = None  # background, title and instructions, composed once
+
 def draw_menu():
-    draw_background()
-    
-    # Title
-    title = title_font.render("2 PLAYER ARENA", True, CYAN)
-    title_rect = title.get_rect(center=(WIDTH // 2, HEIGHT // 4))
-    pygame.draw.rect(screen, CYAN, title_rect.inflate(40, 40), 3)
-    screen.blit(title, title_rect)
-    
-    # Instructions
-    instructions = [
-        "Player 1 (Controller): Left stick to move, Right stick to aim, R2 to shoot",
-        "Player 2 (Keyboard): WASD to move, Mouse to aim, Click to shoot",
-        "Press 1-3 to switch weapons (SMG, Shotgun, Sniper)"
-    ]
-    
-    y_offset = HEIGHT // 2 - 20
-    instr_font = pygame.font.SysFont("Arial", 24)
-    for instruction in instructions:
-        text = instr_font.render(instruction, True, WHITE)
-        screen.blit(text, (WIDTH // 2 - text.get_width() // 2, y_offset))
-        y_offset += 50
-    
+    """Draw the start menu apart from its button, from menu_frame unless the
+    background has changed since it was composed"""
+    global menu_frame
+    background = static_layer.get()
+    if static_layer.changed or menu_frame is None or menu_frame.get_size() != screen.get_size():
+        menu_frame = background.copy()
+
+        # Title
+        title = render_text(title_font, "2 PLAYER ARENA", CYAN)
+        title_rect = title.get_rect(center=(WIDTH // 2, HEIGHT // 4))
+        pygame.draw.rect(menu_frame, CYAN, title_rect.inflate(40, 40), 3)
+        menu_frame.blit(title, title_rect)
+
+        # Instructions
+        instructions = [
+            "Controllers: Left stick to move, Right stick to aim, R2 to shoot, L1/R1 to switch",
+            "Keyboard: WASD to move, Mouse to aim, Click to shoot",
+            "Press 1-3 to switch weapons (SMG, Shotgun, Sniper)"
+        ]
+
+        y_offset = HEIGHT // 2 - 20
+        for instruction in instructions:
+            text = render_text(instr_font, instruction, WHITE)
+            menu_frame.blit(text, (WIDTH // 2 - text.get_width() // 2, y_offset))
+            y_offset += 50
+    screen.blit(menu_frame, (0, 0))
     return start_button
 
 start_button = None  # Will be created in menu state
 
-def show_menu():
-    global start_button
+def show_menu(time_startup=False):
+    """Run the start menu; returns False if the window was closed. The first
+    time it's drawn, first_frame_ms is recorded and finish_startup() runs (or
+    with time_startup, the menu returns False right away instead).
+
+    The menu sleeps in pygame.event.wait() and only redraws when the button's
+    hover state changes or the window needs repainting, so it costs next to
+    nothing while nobody touches it."""
+    global start_button, first_frame_ms
     start_button = Button(WIDTH // 2 - 150, HEIGHT - 200, 300, 80, "START GAME", BLUE, CYAN)
+    start_button.update_hover(mouse_position())
     
     menu_running = True
+    redraw = True
     while menu_running:
-        clock.tick(FPS)
-        mouse_pos = pygame.mouse.get_pos()
-        start_button.update_hover(mouse_pos)
-        
-        draw_menu()
-        start_button.draw()
-        
-        for event in pygame.event.get():
+        if redraw:
+            draw_menu()
+            start_button.draw()
+            present()
+            redraw = False
+        if first_frame_ms is None:
+            first_frame_ms = (time.perf_counter() - STARTED) * 1000
+            if time_startup:
+                return False
+            finish_startup()
+
+        events = [pygame.event.wait(IDLE_WAKE_MS)] + pygame.event.get()
+        for event in events:
             if event.type == pygame.QUIT:
                 return False
+            if event.type == pygame.MOUSEMOTION:
+                hover = start_button.hover
+                start_button.update_hover(mouse_position(event.pos))
+                redraw = redraw or start_button.hover != hover
             if event.type == pygame.MOUSEBUTTONDOWN:
-                if start_button.is_clicked(mouse_pos):
+                if start_button.is_clicked(mouse_position(event.pos)):
                     play_ui_sound()
                     menu_running = False
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_RETURN or event.key == pygame.K_SPACE:
                     play_ui_sound()
-        pygame.display.flip()
+            if event.type in REDRAW_EVENTS:
+                redraw = True
+        sounds.flush()
     
     return True
 
-def show_game_over(winner):
+def show_game_over(winner, winner_color=WHITE, duration=3000):
+    """Show the winner for duration ms, then return True (or False if the
+    window was closed). The frame is drawn once and the wait is spent asleep
+    in pygame.event.wait()."""
     # Winner text
-    winner_color = BLUE if winner == "PLAYER 1" else GREEN
     winner_text = title_font.render(f"{winner} WINS!", True, winner_color)
     winner_rect = winner_text.get_rect(center=(WIDTH // 2, HEIGHT // 2))
-    
-    # Display winner for 3 seconds then return to menu
-    start_time = pygame.time.get_ticks()
-    display_duration = 3000  # 3 seconds in milliseconds
-    
+    end_time = pygame.time.get_ticks() + duration
+
+    redraw = True
     while True:
-        clock.tick(FPS)
-        elapsed = pygame.time.get_ticks() - start_time
-        
-        draw_background()
-        pygame.draw.rect(screen, winner_color, winner_rect.inflate(60, 60), 3)
-        screen.blit(winner_text, winner_rect)
-        
-        # Check for quit event
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                return False
-        
-        pygame.display.flip()
-        
+        if redraw:
+            draw_background()
+            pygame.draw.rect(screen, winner_color, winner_rect.inflate(60, 60), 3)
+            screen.blit(winner_text, winner_rect)
+            present()
+            redraw = False
+
         # Auto return to menu after duration
-        if elapsed >= display_duration:
+        remaining = end_time - pygame.time.get_ticks()
+        if remaining <= 0:
             return True
+        for event in [pygame.event.wait(min(remaining, IDLE_WAKE_MS))] + pygame.event.get():
+            if event.type == pygame.QUIT:
+                return False
+            if event.type in REDRAW_EVENTS:
+                redraw = True
 
-# Show menu first
-if not show_menu():
-    pygame.quit()
-    exit()
+CONTROLLER_AXES = (0, 1, 2, 3, 5)  # left stick x/y, right stick x/y, R2
 
-while True:
-    player1 = Player(200, 350, BLUE)
-    player2 = Player(1000, 350, GREEN)
-    bullets = []
-    
-    # Generate obstacles
-    obstacles = []
-    for i in range(8):
-        x = random.randint(100, WIDTH - 100)
-        y = random.randint(100, HEIGHT - 100)
-        w = random.randint(40, 100)
-        h = random.randint(40, 100)
-        obstacles.append(Obstacle(x, y, w, h))
+class PadState:
+    """One controller's sticks, R2 and shoulder buttons for one tick"""
+    def __init__(self, axes=(0.0,) * len(CONTROLLER_AXES), l1=False, r1=False):
+        self.axes = axes  # values of CONTROLLER_AXES
+        self.l1 = l1
+        self.r1 = r1
 
-    running = True
-    game_over = False
-    while running:
-        clock.tick(FPS)
-        
-        # Update camera to follow average of both players
-        camera_offset[0] += (((player1.x + player2.x) / 2) - camera_offset[0]) * 0.05
-        camera_offset[1] += (((player1.y + player2.y) / 2) - camera_offset[1]) * 0.05
-        
-        draw_background()
+class DeviceState:
+    """Raw controller, keyboard and mouse state for one tick.
 
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-                game_over = True
+    This is what gets recorded and replayed; device_inputs() turns it into each
+    player's PlayerInput. pads has one entry per player: the PadState of the
+    controller bound to them, or None. Axes are quantized to 16 bits when
+    sampled so live play and replays see exactly the same values.
+    """
+    def __init__(self, pads=(None, None), keyboard_player=1,
+                 keys=(False, False, False, False), mouse=(0, 0), mouse_button=False,
+                 weapon_key=None):
+        self.pads = pads
+        self.keyboard_player = keyboard_player  # player on keyboard and mouse, or None
+        self.keys = keys              # W, A, S, D held
+        self.mouse = mouse
+        self.mouse_button = mouse_button
+        self.weapon_key = weapon_key  # weapon picked with 1-3 this tick, or None
 
-            # Keyboard switching
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_1:
-                    player2.weapon = 0
-                    play_ui_sound()
-                if event.key == pygame.K_2:
-                    player2.weapon = 1
-                    play_ui_sound()
-                if event.key == pygame.K_3:
-                    player2.weapon = 2
-                    play_ui_sound()
+class InputBindings:
+    """Which controller drives each player, kept current as controllers are
+    plugged in and pulled out.
 
-        keys = pygame.key.get_pressed()
+    One player (keyboard_player, None for nobody) always plays on keyboard and
+    mouse; every other player takes the next controller to show up, and goes
+    idle if theirs is unplugged until another one arrives.
+    """
+    def __init__(self, player_count=2, keyboard_player=-1):
+        self.player_count = player_count
+        self.keyboard_player = keyboard_player % player_count if keyboard_player is not None else None
+        self.joysticks = [None] * player_count  # pygame Joystick bound to each player
+        self.refresh()
 
-        # Player 2 Movement - check collisions BEFORE moving
-        move_x, move_y = 0, 0
-        if keys[pygame.K_w]: move_y -= 5
-        if keys[pygame.K_s]: move_y += 5
-        if keys[pygame.K_a]: move_x -= 5
-        if keys[pygame.K_d]: move_x += 5
-        
-        # Only apply movement if it doesn't collide with obstacles
-        new_x = max(5, min(WIDTH - 5, player2.x + move_x))
-        new_y = max(5, min(HEIGHT - 5, player2.y + move_y))
-        
-        can_move = True
-        for obstacle in obstacles:
-            if obstacle.collides_with_circle(new_x, new_y, player2.radius):
-                can_move = False
+    def refresh(self):
+        """Catch up with controllers that came or went while nobody was
+        listening for events, e.g. at startup or during the menus"""
+        if not pygame.joystick.get_init():
+            pygame.joystick.init()
+        attached = {pygame.joystick.Joystick(device_index).get_instance_id()
+                    for device_index in range(pygame.joystick.get_count())}
+        for player, bound in enumerate(self.joysticks):
+            if bound and bound.get_instance_id() not in attached:
+                self.joysticks[player] = None
+        for device_index in range(pygame.joystick.get_count()):
+            self.add(device_index)
+
+    def add(self, device_index):
+        joystick = pygame.joystick.Joystick(device_index)
+        if any(bound and bound.get_instance_id() == joystick.get_instance_id()
+               for bound in self.joysticks):
+            return None
+        for player, bound in enumerate(self.joysticks):
+            if bound is None and player != self.keyboard_player:
+                joystick.init()
+                self.joysticks[player] = joystick
+                return player
+        return None
+
+    def remove(self, instance_id):
+        for player, bound in enumerate(self.joysticks):
+            if bound and bound.get_instance_id() == instance_id:
+                self.joysticks[player] = None
+                return player
+        return None
+
+    def handle(self, event):
+        """Follow JOYDEVICEADDED / JOYDEVICEREMOVED"""
+        if event.type == pygame.JOYDEVICEADDED:
+            self.add(event.device_index)
+        elif event.type == pygame.JOYDEVICEREMOVED:
+            self.remove(event.instance_id)
+
+def quantize_axis(value):
+    return round(max(-1.0, min(1.0, value)) * 32767) / 32767
+
+def sample_pad(joystick):
+    return PadState(tuple(quantize_axis(joystick.get_axis(axis)) for axis in CONTROLLER_AXES),
+                    bool(joystick.get_button(4)), bool(joystick.get_button(5)))
+
+def sample_devices(events, bindings):
+    """Read every bound controller, the keyboard and the mouse for this frame"""
+    state = DeviceState(keyboard_player=bindings.keyboard_player)
+    for event in events:
+        bindings.handle(event)
+        if event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_1:
+                state.weapon_key = 0
+            if event.key == pygame.K_2:
+                state.weapon_key = 1
+            if event.key == pygame.K_3:
+                state.weapon_key = 2
+
+    keys = pygame.key.get_pressed()
+    state.keys = (keys[pygame.K_w], keys[pygame.K_a], keys[pygame.K_s], keys[pygame.K_d])
+    # Aim is in world coordinates, so recordings don't depend on where the camera was
+    mouse_x, mouse_y = mouse_position()
+    state.mouse = (mouse_x + view_offset[0], mouse_y + view_offset[1])
+    state.mouse_button = pygame.mouse.get_pressed()[0]
+    state.pads = tuple(sample_pad(joystick) if joystick else None for joystick in bindings.joysticks)
+    return state
+
+def keyboard_mouse_input(state):
+    """WASD to move, mouse to aim and shoot, 1-3 to pick a weapon"""
+    player_input = PlayerInput(weapon=state.weapon_key)
+    w, a, s, d = state.keys
+    if w: player_input.move_y -= 1
+    if s: player_input.move_y += 1
+    if a: player_input.move_x -= 1
+    if d: player_input.move_x += 1
+
+    player_input.aim_point = state.mouse
+    player_input.fire = state.mouse_button
+    return player_input
+
+def controller_input(pad):
+    """Left stick to move, right stick to aim, R2 to shoot, L1/R1 to switch"""
+    if pad is None:
+        return PlayerInput()
+    lx, ly, rx, ry, r2 = pad.axes
+    player_input = PlayerInput(lx, ly, aim_stick=(rx, ry), fire=r2 > 0.5)
+    if pad.l1:
+        player_input.cycle = -1
+    if pad.r1:
+        player_input.cycle = 1
+    return player_input
+
+def device_inputs(state):
+    return [keyboard_mouse_input(state) if player == state.keyboard_player else controller_input(pad)
+            for player, pad in enumerate(state.pads)]
+
+# Recording format: the file header, then for each match a b"M" + MATCH_HEADER
+# record and the arena's JSON, followed by one b"T" + TICK_RECORD per simulation
+# tick, itself followed by a PAD_RECORD for each player whose bit is set in its
+# pad mask. Storing the layout keeps replays independent of the generator.
+RECORDING_MAGIC = b"ARENAREC"
+RECORDING_VERSION = 3
+MATCH_HEADER = struct.Struct("<QHBbI")  # seed, tick rate, player count, keyboard player (-1 none),
+                                        # arena JSON length
+TICK_RECORD = struct.Struct("<BhhbB")  # key flags, mouse x, y, weapon key (-1 none), pad mask
+PAD_RECORD = struct.Struct("<5hB")     # axes, L1/R1 flags
+
+class InputRecorder:
+    """Streams each match to a file as its seed plus the DeviceState of every tick"""
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        self.file.write(RECORDING_MAGIC + struct.pack("<H", RECORDING_VERSION))
+
+    def begin_match(self, sim, seed, keyboard_player=None):
+        arena = sim.arena.to_json().encode()
+        self.file.write(b"M" + MATCH_HEADER.pack(seed, sim.tick_rate, len(sim.players),
+                                                 -1 if keyboard_player is None else keyboard_player,
+                                                 len(arena)) + arena)
+
+    def record(self, state):
+        flags = (state.keys[0] | state.keys[1] << 1 | state.keys[2] << 2 | state.keys[3] << 3 |
+                 state.mouse_button << 4)
+        weapon_key = -1 if state.weapon_key is None else state.weapon_key
+        mask = sum(1 << player for player, pad in enumerate(state.pads) if pad)
+        parts = [b"T", TICK_RECORD.pack(flags, state.mouse[0], state.mouse[1], weapon_key, mask)]
+        for pad in state.pads:
+            if pad:
+                parts.append(PAD_RECORD.pack(*(round(axis * 32767) for axis in pad.axes),
+                                             pad.l1 | pad.r1 << 1))
+        self.file.write(b"".join(parts))
+
+    def close(self):
+        self.file.close()
+
+def read_recording(path):
+    """Yield (seed, tick_rate, arena, player_count, states) per recorded match"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:len(RECORDING_MAGIC)] != RECORDING_MAGIC:
+        raise ValueError(f"{path} is not an arena recording")
+    version, = struct.unpack_from("<H", data, len(RECORDING_MAGIC))
+    if version != RECORDING_VERSION:
+        raise ValueError(f"{path} is recording version {version}, expected {RECORDING_VERSION}")
+
+    pos = len(RECORDING_MAGIC) + 2
+    match = None
+    while pos < len(data):
+        tag = data[pos:pos + 1]
+        pos += 1
+        if tag == b"M":
+            if match:
+                yield match
+            seed, tick_rate, player_count, keyboard_player, arena_size = MATCH_HEADER.unpack_from(data, pos)
+            keyboard_player = None if keyboard_player < 0 else keyboard_player
+            pos += MATCH_HEADER.size
+            arena = parse_arena(data[pos:pos + arena_size].decode(), f"{path} at byte {pos}")
+            pos += arena_size
+            match = (seed, tick_rate, arena, player_count, [])
+        elif tag == b"T" and match:
+            flags, mouse_x, mouse_y, weapon_key, mask = TICK_RECORD.unpack_from(data, pos)
+            pos += TICK_RECORD.size
+            pads = [None] * player_count
+            for player in range(player_count):
+                if mask & 1 << player:
+                    *axes, buttons = PAD_RECORD.unpack_from(data, pos)
+                    pos += PAD_RECORD.size
+                    pads[player] = PadState(tuple(axis / 32767 for axis in axes),
+                                            bool(buttons & 1), bool(buttons & 2))
+            match[-1].append(DeviceState(tuple(pads), keyboard_player,
+                                         (bool(flags & 1), bool(flags & 2), bool(flags & 4), bool(flags & 8)),
+                                         (mouse_x, mouse_y), bool(flags & 16),
+                                         None if weapon_key < 0 else weapon_key))
+        else:
+            raise ValueError(f"{path} is corrupt at byte {pos - 1}")
+    if match:
+        yield match
+
+def run_replay(path, render=False):
+    """Re-simulate every match in a recording as fast as possible, optionally
+    drawing each tick, and print the outcome and a digest of the final state"""
+    for number, (seed, tick_rate, arena, player_count, states) in enumerate(read_recording(path), 1):
+        sim = ArenaSimulation(tick_rate=tick_rate, player_count=player_count, arena=arena)
+        particles.clear()
+        if render:
+            update_camera(sim, sim.dt, snap=True)
+        start = time.perf_counter()
+        for state in states:
+            events = sim.step(device_inputs(state))
+            if render:
+                pygame.event.pump()
+                spawn_effects(events)
+                particles.update(sim.dt)
+                update_camera(sim, sim.dt)
+                draw_background(sim.arena)
+                draw_simulation(sim)
+                present()
+            if sim.winner:
                 break
-        
-        if can_move:
-            player2.x = new_x
-            player2.y = new_y
-
-        # Mouse Aim
-        mx, my = pygame.mouse.get_pos()
-        player2.angle = math.atan2(my - player2.y, mx - player2.x)
-
-        # Shoot mouse
-        if pygame.mouse.get_pressed()[0]:
-            now = pygame.time.get_ticks()
-            weapon = WEAPONS[player2.weapon]
-            if now - player2.last_shot > weapon["delay"]:
-                bullets.append(Bullet(player2.x, player2.y, player2.angle,
-                                      weapon["speed"], weapon["damage"], player2, weapon["color"]))
-                play_shoot_sound()
-                player2.last_shot = now
-
-        # Controller Player 1
-        if controller:
-            lx = controller.get_axis(0)
-            ly = controller.get_axis(1)
-            rx = controller.get_axis(2)
-            ry = controller.get_axis(3)
-
-            # Player 1 Movement - check collisions BEFORE moving
-            move_x = lx * 5
-            move_y = ly * 5
-            
-            # Only apply movement if it doesn't collide with obstacles
-            new_x = max(5, min(WIDTH - 5, player1.x + move_x))
-            new_y = max(5, min(HEIGHT - 5, player1.y + move_y))
-            
-            can_move = True
-            for obstacle in obstacles:
-                if obstacle.collides_with_circle(new_x, new_y, player1.radius):
-                    can_move = False
-                    break
-            
-            if can_move:
-                player1.x = new_x
-                player1.y = new_y
+        elapsed = time.perf_counter() - start
+        print(f"match {number}: {sim.ticks}/{len(states)} ticks in {elapsed:.2f}s "
+              f"({sim.ticks / max(elapsed, 1e-9):.0f} ticks/s), winner {sim.winner or '-'}, "
+              f"hp {'/'.join(str(player.hp) for player in sim.players)}, state {sim.digest()}")
 
-            # Reduced aim sensitivity for finer angle control with proper 360 wrapping
-            if abs(rx) > 0.2 or abs(ry) > 0.2:
-                target_angle = math.atan2(ry, rx)
-                # Use normalize_angle_diff for smooth 360-degree rotation
-                angle_diff = normalize_angle_diff(target_angle, player1.angle)
-                player1.angle += angle_diff * 0.15
-
-            # R2 shoot
-            if controller.get_axis(5) > 0.5:
-                now = pygame.time.get_ticks()
-                weapon = WEAPONS[player1.weapon]
-                if now - player1.last_shot > weapon["delay"]:
-                    bullets.append(Bullet(player1.x, player1.y, player1.angle,
-                                          weapon["speed"], weapon["damage"], player1, weapon["color"]))
-                    play_shoot_sound()
-                    player1.last_shot = now
-
-            # L1 / R1 weapon switch
-            now = pygame.time.get_ticks()
-            if now - player1.last_weapon_switch > 200:  # 200ms debounce
-                if controller.get_button(4):
-                    player1.weapon = (player1.weapon - 1) % 3
-                    play_ui_sound()
-                    player1.last_weapon_switch = now
-                if controller.get_button(5):
-                    player1.weapon = (player1.weapon + 1) % 3
-                    play_ui_sound()
-                    player1.last_weapon_switch = now
-
-        # Bullet logic
-        for bullet in bullets[:]:
-            bullet.move()
-            bullet.draw()
-
-            target = player2 if bullet.owner == player1 else player1
-            dist = math.hypot(bullet.x - target.x, bullet.y - target.y)
-
-            if dist < target.radius:
-                target.hp -= bullet.damage
-                play_hit_sound()
-                bullets.remove(bullet)
-            elif bullet.off_screen():
-                bullets.remove(bullet)
+def play_events(events):
+    for kind, player in events:
+        if kind == "shoot":
+            play_shoot_sound()
+        elif kind == "hit":
+            play_hit_sound()
+        elif kind == "switch":
+            play_ui_sound()
+
+def draw_simulation(sim, alpha=1.0):
+    """Draw everything that moves (obstacles live in the static layer) alpha of
+    the way between the last two ticks, and return the screen areas drawn"""
+    rects = sim.bullets.draw((1 - alpha) * sim.dt)
+    rects.extend(particles.draw())
+    profiler.lap("draw_bullets")
+
+    # Room for every player's body at every aim step with any weapon, so eight
+    # players turning around don't keep evicting each other
+    surface_cache.reserve(SURFACE_CACHE_SIZE + len(sim.players) * len(WEAPONS) * PLAYER_ANGLE_STEPS)
+    for player in sim.players:
+        if player.hp > 0:
+            rect = player.draw(alpha)
+            if rect:
+                rects.append(rect)
+    profiler.lap("draw_players")
+
+    for player, (x, y, width) in zip(sim.players, weapon_ui_layout(len(sim.players))):
+        rects.append(draw_weapon_ui(player, x, y, width))
+    profiler.lap("hud")
+    return rects
+
+def update_camera(sim, frame_time, snap=False):
+    """Ease the camera toward the average position of the players still standing
+    (or jump straight there with snap). An arena bigger than the screen scrolls
+    to keep that point in the middle of the screen, without going past its edges."""
+    alive = [player for player in sim.players if player.hp > 0] or sim.players
+    follow = 1 if snap else 1 - 0.95 ** (frame_time * BASE_RATE)
+    camera_offset[0] += (sum(player.x for player in alive) / len(alive) - camera_offset[0]) * follow
+    camera_offset[1] += (sum(player.y for player in alive) / len(alive) - camera_offset[1]) * follow
+    view_offset[0] = int(max(0, min(sim.width - WIDTH, camera_offset[0] - WIDTH / 2)))
+    view_offset[1] = int(max(0, min(sim.height - HEIGHT, camera_offset[1] - HEIGHT / 2)))
+
+def random_input(rng):
+    """Mash random controls, for soak-testing the simulation without players"""
+    return PlayerInput(rng.uniform(-1, 1), rng.uniform(-1, 1),
+                       aim_stick=(rng.uniform(-1, 1), rng.uniform(-1, 1)),
+                       fire=rng.random() < 0.5,
+                       cycle=rng.choice((-1, 0, 0, 0, 0, 1)))
+
+def run_headless(ticks, seed=None, tick_rate=SIM_RATE, player_count=2, arena=None):
+    """Run back-to-back matches on random input as fast as the CPU allows"""
+    rng = random.Random(seed)
+    sim = ArenaSimulation(seed=rng.random(), tick_rate=tick_rate, player_count=player_count, arena=arena)
+    matches = 0
+    start = time.perf_counter()
+    for _ in range(ticks):
+        sim.step([random_input(rng) for _ in sim.players])
+        if sim.winner:
+            matches += 1
+            sim = ArenaSimulation(seed=rng.random(), tick_rate=tick_rate, player_count=player_count,
+                                  arena=arena)
+    elapsed = time.perf_counter() - start
+    print(f"{ticks} ticks in {elapsed:.2f}s ({ticks / elapsed:.0f} ticks/s), {matches} matches finished")
+
+BOT_BUDGET_US = 300  # decision time per tick, for all bots together
+
+class BotParams:
+    """Tuning knobs for BotSquad; selfplay.py plays variants against each other"""
+    def __init__(self, aim_error=0.06, dodge_horizon=0.15, dodge_margin=4, think_interval=6,
+                 shotgun_range=220, sniper_range=560):
+        self.aim_error = aim_error            # std dev of aim noise, radians
+        self.dodge_horizon = dodge_horizon    # seconds ahead incoming bullets are checked
+        self.dodge_margin = dodge_margin      # px added to the player radius when dodging
+        self.think_interval = think_interval  # ticks between picking target, weapon and strafe
+        self.shotgun_range = shotgun_range    # closer than this: shotgun
+        self.sniper_range = sniper_range      # further than this: sniper; between: SMG
+
+    @classmethod
+    def parse(cls, settings):
+        """BotParams from "name=value" strings; ValueError for an unknown
+        setting or a value out of range (negative, or a think_interval under 1)"""
+        params = cls()
+        for setting in settings:
+            name, _, value = setting.partition("=")
+            if name not in vars(params):
+                raise ValueError(f"unknown bot setting {name!r}")
+            setattr(params, name, type(getattr(params, name))(value))
+        for name, value in vars(params).items():
+            least = 1 if name == "think_interval" else 0
+            if not (math.isfinite(value) and value >= least):
+                raise ValueError(f"bot setting {name} must be at least {least}, not {value}")
+        return params
+
+class BotSquad:
+    """Computer players that produce the same PlayerInput a controller or the
+    keyboard would, so step() can't tell them from people.
+
+    decide() handles every bot at once: line of sight from each bot to each
+    player is one batched sweep against the obstacles, and incoming fire is one
+    batched sweep of every bullet's next dodge_horizon seconds against every
+    bot. Decisions depend only on the match state and the seed, so a match
+    between bots plays out the same every time; the time they take is measured
+    against budget_us microseconds per tick.
+    """
+    def __init__(self, indices, seed=None, params=None, budget_us=BOT_BUDGET_US):
+        self.indices = list(indices)
+        self.rng = random.Random(seed)
+        self.params = params or BotParams()
+        self.budget_us = budget_us
+        self.plans = {}  # bot index -> [target index, strafe direction]
+        self.decisions = 0
+        self.over_budget = 0
+        self.total_us = 0.0
+        self.worst_us = 0.0
+
+    def decide(self, sim):
+        """PlayerInput for each bot this tick, as {player index: input}"""
+        start = time.perf_counter()
+        players = sim.players
+        inputs = {index: PlayerInput() for index in self.indices}
+        bots = [index for index in self.indices if players[index].hp > 0]
+        if bots:
+            px = np.array([player.x for player in players], dtype=float)
+            py = np.array([player.y for player in players], dtype=float)
+            bx = px[bots]
+            by = py[bots]
+            dx = px[None, :] - bx[:, None]
+            dy = py[None, :] - by[:, None]
+            count = len(players)
+            visible = ~np.isfinite(sim.obstacle_grid.sweep(np.repeat(bx, count), np.repeat(by, count),
+                                                           dx.ravel(), dy.ravel())).reshape(len(bots), count)
+            distance = np.hypot(dx, dy)
+            threats = self.threats(sim, bots, bx, by)
+            for row, index in enumerate(bots):
+                inputs[index] = self.decide_one(sim, index, visible[row], distance[row], threats[row])
+
+        elapsed_us = (time.perf_counter() - start) * 1e6
+        self.decisions += 1
+        self.total_us += elapsed_us
+        self.worst_us = max(self.worst_us, elapsed_us)
+        if elapsed_us > self.budget_us:
+            self.over_budget += 1
+        return inputs
+
+    def threats(self, sim, bots, bx, by):
+        """Per bot, the (x, y, vx, vy) of the enemy bullet that would hit it
+        soonest if both kept going, or None"""
+        bullets = sim.bullets
+        n = bullets.count
+        if not n:
+            return [None] * len(bots)
+        horizon = self.params.dodge_horizon
+        radius = np.array([sim.players[index].radius for index in bots], dtype=float)[:, None]
+        t = sweep_circles(bullets.x[:n], bullets.y[:n], bullets.vx[:n] * horizon, bullets.vy[:n] * horizon,
+                          bx[:, None], by[:, None], radius + self.params.dodge_margin)
+        t[bullets.owner[:n] == np.array(bots)[:, None]] = np.inf
+        first = t.argmin(axis=1)
+        result = []
+        for row, i in enumerate(first.tolist()):
+            if np.isfinite(t[row, i]):
+                result.append((bullets.x[i], bullets.y[i], bullets.vx[i], bullets.vy[i]))
             else:
-                # Check collision with obstacles
-                bullet_hit_obstacle = False
-                for obstacle in obstacles:
-                    if obstacle.collides_with_point(bullet.x, bullet.y):
-                        bullet_hit_obstacle = True
-                        if bullet in bullets:
-                            bullets.remove(bullet)
-                        break
-                if bullet_hit_obstacle:
-                    continue
-
-        player1.draw()
-        player2.draw()
-        
-        # Draw obstacles
-        for obstacle in obstacles:
-            obstacle.draw()
+                result.append(None)
+        return result
+
+    def decide_one(self, sim, index, visible, distance, threat):
+        params = self.params
+        player = sim.players[index]
+        plan = self.plans.get(index)
+        thinking = plan is None or (sim.ticks + index) % params.think_interval == 0
+        if thinking or sim.players[plan[0]].hp <= 0:
+            plan = self.plans[index] = [self.pick_target(sim, index, visible, distance),
+                                        plan[1] if plan else self.rng.choice((-1, 1))]
+        target_index, strafe = plan
+        target = sim.players[target_index]
+        player_input = PlayerInput()
+        if target_index == index:
+            return player_input  # nobody left to fight
+        gap = distance[target_index]
+
+        # Weapon for the range, switched only while thinking so it doesn't flap
+        if thinking:
+            weapon = 1 if gap < params.shotgun_range else 2 if gap > params.sniper_range else 0
+            if weapon != player.weapon:
+                player_input.weapon = weapon
+
+        # Aim where the target will be when the bullet gets there
+        flight = gap / (WEAPONS[player.weapon]["speed"] * BASE_RATE)
+        lead_x = target.x + (target.x - target.prev_x) / sim.dt * flight
+        lead_y = target.y + (target.y - target.prev_y) / sim.dt * flight
+        angle = math.atan2(lead_y - player.y, lead_x - player.x) + self.rng.gauss(0, params.aim_error)
+        player_input.aim_point = (player.x + math.cos(angle) * 100, player.y + math.sin(angle) * 100)
+        player_input.fire = bool(visible[target_index])
+
+        if threat is not None:
+            # Step out of the bullet's line, to whichever side we're already on
+            bullet_x, bullet_y, vx, vy = threat
+            speed = math.hypot(vx, vy)
+            side_x, side_y = -vy / speed, vx / speed
+            side = 1 if (player.x - bullet_x) * side_x + (player.y - bullet_y) * side_y >= 0 else -1
+            move_x, move_y = side_x * side, side_y * side
+        else:
+            # Circle the target, closing in or backing off to the weapon's
+            # range; out of sight, mostly circle to get around what's in the way
+            to_x = (target.x - player.x) / max(gap, 1)
+            to_y = (target.y - player.y) / max(gap, 1)
+            if not visible[target_index]:
+                approach = 0.3
+            else:
+                ideal = (params.shotgun_range * 0.6 if player.weapon == 1 else
+                         params.sniper_range * 1.2 if player.weapon == 2 else
+                         (params.shotgun_range + params.sniper_range) / 2)
+                approach = max(-1, min(1, (gap - ideal) / 100))
+            move_x = to_x * approach - to_y * strafe
+            move_y = to_y * approach + to_x * strafe
+        player_input.move_x, player_input.move_y = self.steer(sim, player, plan, move_x, move_y)
+        return player_input
+
+    def pick_target(self, sim, index, visible, distance):
+        """Nearest living opponent, preferring ones in sight; the bot itself if none are left"""
+        best = index
+        best_key = None
+        for other, player in enumerate(sim.players):
+            if other == index or player.hp <= 0:
+                continue
+            key = (not visible[other], distance[other])
+            if best_key is None or key < best_key:
+                best, best_key = other, key
+        return best
+
+    def steer(self, sim, player, plan, move_x, move_y, lookahead=4):
+        """Turn the wanted direction aside if it runs into an obstacle or the
+        arena edge within lookahead ticks; reverses the strafe direction if it
+        had to turn more than a right angle"""
+        length = math.hypot(move_x, move_y)
+        if length < 1e-6:
+            return 0.0, 0.0
+        move_x /= length
+        move_y /= length
+        reach = PLAYER_SPEED * sim.frame_scale * lookahead
+        for turn in (0.0, 0.8, -0.8, 1.6, -1.6, 2.4, -2.4):
+            cos, sin = math.cos(turn), math.sin(turn)
+            x = move_x * cos - move_y * sin
+            y = move_x * sin + move_y * cos
+            ahead_x = player.x + x * reach
+            ahead_y = player.y + y * reach
+            inside = (player.radius <= ahead_x <= sim.width - player.radius and
+                      player.radius <= ahead_y <= sim.height - player.radius)
+            if inside and not sim.blocked(ahead_x, ahead_y, player.radius):
+                if abs(turn) > math.pi / 2:
+                    plan[1] = -plan[1]
+                return x, y
+        return move_x, move_y
+
+    def summary(self):
+        mean = self.total_us / max(self.decisions, 1)
+        return (f"{self.decisions} decisions, {mean:.0f} us mean / {self.worst_us:.0f} us max, "
+                f"{self.over_budget} over the {self.budget_us} us budget")
+
+class ProfilerOverlay:
+    """On-screen p50/p99 table for the profiler, toggled with F3.
+
+    The table is re-rendered into a cached surface every refresh frames, so
+    showing it costs one blit per frame. Showing it turns the profiler on, and
+    hiding it turns the profiler back off unless it was already on (--profile).
+    """
+    def __init__(self, refresh=30):
+        self.visible = False
+        self.refresh = refresh
+        self.surface = None
+        self.rendered_at = -refresh
+        self.was_profiling = False
+
+    def toggle(self):
+        self.visible = not self.visible
+        if self.visible:
+            self.was_profiling = profiler.enabled
+            profiler.set_enabled(True)
+        else:
+            profiler.set_enabled(self.was_profiling)
+
+    def render(self):
+        lines = [f"{'phase':<13}{'p50 ms':>8}{'p99 ms':>8}"]
+        total50 = total99 = 0.0
+        for phase, stats in profiler.summary().items():
+            lines.append(f"{phase:<13}{stats['p50']:>8.2f}{stats['p99']:>8.2f}")
+            total50 += stats["p50"]
+            total99 += stats["p99"]
+        lines.append(f"{'sum':<13}{total50:>8.2f}{total99:>8.2f}")
+        lines.append(f"cache {surface_cache.hits} hits / {surface_cache.misses} misses")
+        lines.append(f"sound {sounds.played} played / {sounds.merged} merged / {sounds.stolen} cut off")
+        lines.append(f"detail {quality.name}, {WIDTH}x{HEIGHT} to {display.get_width()}x{display.get_height()}")
+
+        line_height = font.get_linesize()
+        rendered = [font.render(line, True, WHITE) for line in lines]
+        surface = pygame.Surface((max(r.get_width() for r in rendered) + 20,
+                                  line_height * len(rendered) + 20)).convert()
+        surface.fill(BLACK)
+        pygame.draw.rect(surface, GRAY, surface.get_rect(), 2)
+        for i, text in enumerate(rendered):
+            surface.blit(text, (10, 10 + i * line_height))
+        return surface
+
+    def draw(self):
+        if profiler.frames - self.rendered_at >= self.refresh or self.surface is None:
+            self.surface = self.render()
+            self.rendered_at = profiler.frames
+        return screen.blit(self.surface, (10, 60))
+
+profiler_overlay = ProfilerOverlay()
 
-        draw_weapon_ui(player1, 100)
-        draw_weapon_ui(player2, WIDTH - 460)
+def play_match(bindings, dirty_rects=False, fps=FPS, tick_rate=SIM_RATE, recorder=None, bots=0,
+               arena=None, arena_size=None):
+    """Run one match on screen; returns False if the window was closed.
+
+    The simulation advances in fixed ticks of 1 / tick_rate seconds, as many as
+    the real time since the last frame calls for, and each frame is drawn
+    interpolated between the last two ticks. fps only caps rendering (0 for
+    uncapped). A very slow frame is clamped to MAX_FRAME_TIME and catch-up is
+    limited to MAX_STEPS_PER_FRAME, so a hitch slows the game down briefly
+    instead of stalling it or making it jump. bindings says which device drives
+    each player and follows controllers being plugged in and out mid-match;
+    bots more players after those are played by a BotSquad. Without an arena
+    each match gets a freshly generated one, the size of the screen or
+    arena_size (width, height) with as many obstacles as fit_obstacles()
+    says. Each frame's update and draw time
+    is reported to the quality governor, against a budget of one frame at fps.
+    """
+    seed = random.randrange(2 ** 63)
+    if arena is None and arena_size:
+        arena = generate_arena(seed, fit_obstacles(*arena_size), *arena_size, cache=False)
+    sim = ArenaSimulation(seed=seed, tick_rate=tick_rate, player_count=bindings.player_count + bots,
+                          arena=arena)
+    squad = BotSquad(range(bindings.player_count, len(sim.players)), seed) if bots else None
+    if recorder:
+        recorder.begin_match(sim, seed, bindings.keyboard_player)
+    telemetry.match_start(sim, bots)
+    bindings.refresh()
+    particles.clear()
+    update_camera(sim, 0, snap=True)
+    presenter = Presenter(dirty_rects)
+    quality.budget = 1 / (fps or FPS)
+    accumulator = 0.0
+    pending_weapon_key = None  # weapon key pressed on a frame with no tick
+    last_time = time.perf_counter()
+    while True:
+        clock.tick(fps)
+        now = time.perf_counter()
+        frame_time = min(now - last_time, MAX_FRAME_TIME)
+        last_time = now
+        accumulator += frame_time
+        profiler.begin_frame()
+
+        events = pygame.event.get()
+        for event in events:
+            if event.type == pygame.QUIT:
+                return False
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                profiler_overlay.toggle()
+
+        state = sample_devices(events, bindings)
+        if state.weapon_key is None:
+            state.weapon_key = pending_weapon_key
+        profiler.lap("input")
+
+        steps = 0
+        while accumulator >= sim.dt:
+            if recorder:
+                recorder.record(state)
+            inputs = device_inputs(state)
+            if squad:
+                inputs.extend(squad.decide(sim).values())
+            sim_events = sim.step(inputs)
+            telemetry.sim_events(sim)
+            play_events(sim_events)
+            spawn_effects(sim_events)
+            profiler.lap("effects")
+            accumulator -= sim.dt
+            # Weapon selection is a key press, so only the first tick sees it
+            state.weapon_key = None
+            steps += 1
+            if steps >= MAX_STEPS_PER_FRAME or sim.winner:
+                accumulator = min(accumulator, sim.dt)
+                break
+        pending_weapon_key = state.weapon_key
+        sounds.flush()
+        alpha = min(1.0, accumulator / sim.dt)
+        particles.update(frame_time)
+
+        update_camera(sim, frame_time)
+        profiler.lap("effects")
+
+        presenter.begin(sim.arena)
+        profiler.lap("background")
+        rects = draw_simulation(sim, alpha)
+        if profiler_overlay.visible:
+            rects.append(profiler_overlay.draw())
+            profiler.lap("hud")
 
         # Check for game end
-        if player1.hp <= 0:
-            if not show_game_over("PLAYER 2"):
-                game_over = True
-            running = False
-        elif player2.hp <= 0:
-            if not show_game_over("PLAYER 1"):
-                game_over = True
-            running = False
-
-        pygame.display.flip()
-    
-    if game_over:
-        break
-    
-    # Return to menu after game ends
-    if not show_menu():
-        break
+        if sim.winner:
+            telemetry.game_over(sim)
+            return show_game_over(sim.winner, sim.winner_color)
+
+        presenter.end(rects)
+        profiler.lap("present")
+        profiler.end_frame()
+        work = time.perf_counter() - now
+        quality.frame(work)
+        telemetry.frame(frame_time, work)
+
+MIN_RENDER_SIZE = (640, 360)
+
+def parse_size(text, smallest=MIN_RENDER_SIZE, largest=None):
+    """(width, height) from "WxH", for argparse"""
+    try:
+        size = tuple(int(n) for n in text.lower().split("x"))
+    except ValueError:
+        size = ()
+    if len(size) != 2:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, got {text!r}")
+    if size[0] < smallest[0] or size[1] < smallest[1]:
+        raise argparse.ArgumentTypeError("must be at least {}x{}".format(*smallest))
+    if largest and (size[0] > largest[0] or size[1] > largest[1]):
+        raise argparse.ArgumentTypeError("must be at most {}x{}".format(*largest))
+    return size
+
+def parse_arena_size(text):
+    return parse_size(text, largest=MAX_ARENA_SIZE)
+
+def main():
+    parser = argparse.ArgumentParser(description="Multiplayer Arena")
+    parser.add_argument("--headless", action="store_true",
+                        help="simulate matches on random input without rendering")
+    parser.add_argument("--ticks", type=int, default=100000, help="ticks to simulate with --headless")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for --headless")
+    parser.add_argument("--dirty-rects", action="store_true",
+                        help="only push the parts of the screen that changed each frame")
+    parser.add_argument("--fps", type=int, default=FPS, help="render frame cap (0 for uncapped)")
+    parser.add_argument("--tick-rate", type=int, default=SIM_RATE, help="simulation ticks per second")
+    parser.add_argument("--profile", metavar="PATH",
+                        help="record per-phase frame timings and write them to PATH (.csv or .json) on exit")
+    parser.add_argument("--telemetry", metavar="PATH",
+                        help="stream match events and frame stats to PATH (JSON lines, or binary for .bin)")
+    parser.add_argument("--record", metavar="PATH", help="record every match's seed and inputs to PATH")
+    parser.add_argument("--replay", metavar="PATH", help="re-simulate the matches recorded in PATH")
+    parser.add_argument("--render", action="store_true", help="draw the matches while replaying")
+    parser.add_argument("--players", type=int, default=2,
+                        help=f"players per match ({MIN_PLAYERS}-{MAX_PLAYERS})")
+    parser.add_argument("--keyboard-player", type=int, default=None,
+                        help="which player (1-N, 0 for none) plays on keyboard and mouse; default the last human")
+    parser.add_argument("--arena", metavar="PATH", help="play on the arena in PATH instead of random ones")
+    parser.add_argument("--arena-size", type=parse_arena_size, metavar="WxH",
+                        help="generate arenas this big instead of the size of the screen; bigger ones scroll")
+    parser.add_argument("--save-arena", metavar="PATH",
+                        help="write the arena generated from --seed (and --arena-size) to PATH (JSON) and exit")
+    parser.add_argument("--obstacles", type=int, default=None,
+                        help="obstacles in the arena --save-arena generates (default 8 per 1200x700)")
+    parser.add_argument("--bots", type=int, default=0,
+                        help="how many of the players are computer-controlled (the last ones)")
+    parser.add_argument("--render-size", type=parse_size, metavar="WxH",
+                        help="draw the scene at this resolution and scale it to the display "
+                             "(default the display's own; also sets the play area size)")
+    parser.add_argument("--quality", choices=["auto"] + [level[0] for level in QUALITY_LEVELS], default="auto",
+                        help="drawing detail; auto lowers it while frames run over budget")
+    parser.add_argument("--time-startup", action="store_true",
+                        help="print the time from launch to the first menu frame, then exit")
+    args = parser.parse_args()
+    if not MIN_PLAYERS <= args.players <= MAX_PLAYERS:
+        parser.error(f"--players must be {MIN_PLAYERS}-{MAX_PLAYERS}")
+    if not 0 <= args.bots < args.players:
+        parser.error(f"--bots must be 0-{args.players - 1}")
+    humans = args.players - args.bots
+    if args.keyboard_player is not None and not 0 <= args.keyboard_player <= humans:
+        parser.error(f"--keyboard-player must be 0-{humans}")
+    if args.bots and args.record:
+        parser.error("--record only records human input and can't be combined with --bots")
+    if args.save_arena:
+        with open(args.save_arena, "w") as f:
+            size = args.arena_size or (WIDTH, HEIGHT)
+            f.write(generate_arena(args.seed, args.obstacles or fit_obstacles(*size), *size).to_json())
+        pygame.quit()
+        return
+    try:
+        arena = load_arena(args.arena) if args.arena else None
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+    if args.profile:
+        profiler.set_enabled(True)
+    if args.quality != "auto":
+        quality.adaptive = False
+        quality.set_level([level[0] for level in QUALITY_LEVELS].index(args.quality))
+
+    if args.headless:
+        run_headless(args.ticks, args.seed, args.tick_rate, args.players, arena)
+        pygame.quit()
+        return
+    if args.replay:
+        if args.render:
+            init_display(render_size=args.render_size)
+        run_replay(args.replay, args.render)
+        pygame.quit()
+        return
+
+    init_display(render_size=args.render_size)
+    if args.time_startup:
+        show_menu(time_startup=True)
+        print(f"first menu frame after {first_frame_ms:.1f} ms")
+        pygame.quit()
+        return
+
+    if args.keyboard_player is None:
+        keyboard_player = -1
+    else:
+        keyboard_player = args.keyboard_player - 1 if args.keyboard_player else None
+    recorder = InputRecorder(args.record) if args.record else None
+    if args.telemetry:
+        telemetry.open(args.telemetry)
+    # Show menu first
+    if show_menu():
+        bindings = InputBindings(humans, keyboard_player)
+        while play_match(bindings, args.dirty_rects, args.fps, args.tick_rate, recorder, args.bots, arena,
+                         args.arena_size) \
+                and show_menu():
+            pass
+    if recorder:
+        recorder.close()
+    telemetry.close()
+    if telemetry.dropped:
+        print(f"telemetry: {telemetry.dropped} events dropped")
+    if args.profile:
+        profiler.export(args.profile)
+    pygame.quit()
 
-pygame.quit()
+if __name__ == "__main__":
+    main()
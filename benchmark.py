@@ -0,0 +1,345 @@
+"""Performance benchmarks for the arena simulation.
+
+Runs under the SDL dummy drivers, so no display is needed:
+
+    python benchmark.py collision
+    python benchmark.py scenarios --output results.json --compare baseline.json
+"""
+import os
+import re
+import sys
+import json
+import random
+import platform
+import subprocess
+import time
+import tracemalloc
+import argparse
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import math
+import numpy as np
+import arena_game as game
+
+ARENA_WIDTH, ARENA_HEIGHT = 1200, 700
+
+def linear_collisions(obstacles, bounds, players, bullets):
+    """One frame of collision checks testing every obstacle, as before the grid"""
+    for x, y in players:
+        for obstacle in obstacles:
+            if obstacle.collides_with_circle(x, y, 20):
+                break
+    left, top, right, bottom = bounds
+    return game.sweep_rects(*bullets, left[:, None], top[:, None], right[:, None], bottom[:, None]).min(axis=0)
+
+def grid_collisions(grid, players, bullets):
+    """One frame of collision checks through the ObstacleGrid"""
+    for x, y in players:
+        grid.circle_blocked(x, y, 20)
+    return grid.sweep(*bullets)
+
+def time_per_frame(fn, frames):
+    start = time.perf_counter()
+    for _ in range(frames):
+        fn()
+    return (time.perf_counter() - start) / frames * 1e6
+
+def bench_collision(args):
+    """Per-frame obstacle collision cost for both players plus a bullet field"""
+    rng = random.Random(args.seed)
+    print(f"{'obstacles':>10} {'linear us':>12} {'grid us':>12} {'speedup':>8}")
+    for count in (8, 100, 1000):
+        obstacles = game.generate_obstacles(rng, count, ARENA_WIDTH, ARENA_HEIGHT)
+        grid = game.ObstacleGrid(obstacles, ARENA_WIDTH, ARENA_HEIGHT)
+        bounds = (grid.left, grid.top, grid.right, grid.bottom)
+        players = [(rng.uniform(0, ARENA_WIDTH), rng.uniform(0, ARENA_HEIGHT)) for _ in range(2)]
+        # Each bullet sweeps the path of one SMG frame
+        angles = np.array([rng.uniform(0, 2 * np.pi) for _ in range(args.bullets)])
+        bullets = (np.array([rng.uniform(0, ARENA_WIDTH) for _ in range(args.bullets)]),
+                   np.array([rng.uniform(0, ARENA_HEIGHT) for _ in range(args.bullets)]),
+                   np.cos(angles) * game.WEAPONS[0]["speed"],
+                   np.sin(angles) * game.WEAPONS[0]["speed"])
+
+        linear = time_per_frame(lambda: linear_collisions(obstacles, bounds, players, bullets), args.frames)
+        gridded = time_per_frame(lambda: grid_collisions(grid, players, bullets), args.frames)
+        print(f"{count:>10} {linear:>12.1f} {gridded:>12.1f} {linear / gridded:>7.1f}x")
+
+def bench_particles(args):
+    """Per-frame update and draw cost of the particle pool at increasing load"""
+    print(f"{'particles':>10} {'update us':>12} {'draw us':>12}")
+    for count in (1000, 4000, game.MAX_PARTICLES):
+        pool = game.ParticlePool(seed=args.seed)
+        colors = [weapon["color"] for weapon in game.WEAPONS.values()]
+        for i in range(count // 8):
+            pool.emit(ARENA_WIDTH / 2, ARENA_HEIGHT / 2, 8, colors[i % len(colors)], 300, 1000)
+        update = time_per_frame(lambda: pool.update(1 / 60), args.frames)
+        draw = time_per_frame(pool.draw, args.frames)
+        print(f"{len(pool):>10} {update:>12.1f} {draw:>12.1f}")
+
+def bench_idle(args):
+    """CPU used by the start menu and game-over screen while nobody touches them"""
+    game.first_frame_ms = 0  # skip the startup work the first menu frame would trigger
+    game.finish_startup()
+    for name, show in (("menu", game.show_menu), ("game over", lambda: game.show_game_over(
+            "PLAYER 1", game.BLUE, duration=int(args.seconds * 1000)))):
+        game.pygame.time.set_timer(game.pygame.QUIT, int(args.seconds * 1000), 1)
+        cpu, wall = time.process_time(), time.perf_counter()
+        show()
+        cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+        game.pygame.time.set_timer(game.pygame.QUIT, 0)
+        game.pygame.event.clear()
+        print(f"{name:>10}: {100 * cpu / wall:5.1f}% CPU over {wall:.1f}s")
+
+# Scripted stress scenarios. Each one builds its state from a seed and returns
+# (update, draw) callables for one frame; everything that varies is derived
+# from the seed or the frame number, so runs are repeatable across commits.
+
+def scripted_input(tick, phase):
+    """Circle around, sweep the aim and hold fire with the SMG"""
+    t = tick / game.SIM_RATE + phase
+    return game.PlayerInput(math.cos(t), math.sin(t), aim_stick=(math.cos(2 * t), math.sin(2 * t)),
+                            fire=True, weapon=0 if tick == 0 else None)
+
+def match_scenario(arena, player_count=2, follow=False):
+    """Every player fires the SMG continuously; a new match starts when one is
+    left. With follow the camera tracks the players, scrolling a big arena."""
+    state = {"sim": game.ArenaSimulation(player_count=player_count, arena=arena)}
+
+    def update():
+        sim = state["sim"]
+        events = sim.step([scripted_input(sim.ticks, 2 * math.pi * i / player_count)
+                           for i in range(player_count)])
+        game.spawn_effects(events)
+        game.particles.update(sim.dt)
+        if sim.winner:
+            state["sim"] = game.ArenaSimulation(player_count=player_count, arena=arena)
+
+    def draw():
+        sim = state["sim"]
+        if follow:
+            game.update_camera(sim, sim.dt)
+        game.draw_background(sim.arena)
+        game.draw_simulation(sim)
+        game.present()
+
+    return update, draw
+
+def scenario_smg_duel(seed):
+    return match_scenario(game.generate_arena(seed, 8, ARENA_WIDTH, ARENA_HEIGHT))
+
+def scenario_obstacles_500(seed, count=500, lane=60):
+    """Far too crowded for generate_arena(), so the obstacles overlap and skip
+    validation; but like there, none may touch a spawn point, and a lane
+    between the two is kept clear so the players can move and shots fly"""
+    rng = random.Random(seed)
+    spawns = game.spawn_points(2, ARENA_WIDTH, ARENA_HEIGHT)
+    clearance = game.PLAYER_RADIUS + game.SPAWN_CLEARANCE
+    lane_rect = game.pygame.Rect(0, ARENA_HEIGHT // 2 - lane, ARENA_WIDTH, 2 * lane)
+    obstacles = []
+    while len(obstacles) < count:
+        obstacle = game.generate_obstacles(rng, 1, ARENA_WIDTH, ARENA_HEIGHT)[0]
+        if not (obstacle.rect.colliderect(lane_rect) or
+                any(obstacle.collides_with_circle(x, y, clearance) for x, y in spawns)):
+            obstacles.append(obstacle)
+    return match_scenario(game.Arena(ARENA_WIDTH, ARENA_HEIGHT, obstacles))
+
+def scenario_eight_players(seed):
+    return match_scenario(game.generate_arena(seed, 8, ARENA_WIDTH, ARENA_HEIGHT), player_count=8)
+
+def scenario_big_arena(seed, width=6000, height=3500):
+    """The eight-player free-for-all on a scrolling arena 25 times the size"""
+    arena = game.generate_arena(seed, game.fit_obstacles(width, height), width, height)
+    return match_scenario(arena, player_count=8, follow=True)
+
+def scenario_bullet_storm(seed, bullets=5000):
+    """A constant field of slow, harmless bullets crossing the arena"""
+    rng = random.Random(seed)
+    sim = game.ArenaSimulation(ARENA_WIDTH, ARENA_HEIGHT, seed, bullet_capacity=8192)
+    idle = [game.PlayerInput(), game.PlayerInput()]
+
+    def update():
+        # Top the storm back up to full strength from seeded spawn points
+        while len(sim.bullets) < bullets:
+            sim.bullets.spawn(rng.uniform(0, ARENA_WIDTH), rng.uniform(0, ARENA_HEIGHT),
+                              rng.uniform(0, 2 * math.pi), rng.uniform(60, 240), 0,
+                              rng.randrange(2), rng.randrange(len(game.WEAPONS)))
+        sim.step(idle)
+
+    def draw():
+        game.draw_background(sim.arena)
+        game.draw_simulation(sim)
+        game.present()
+
+    return update, draw
+
+def scenario_menu_idle(seed):
+    """The start menu with nobody touching it"""
+    button = game.Button(game.WIDTH // 2 - 150, game.HEIGHT - 200, 300, 80, "START GAME", game.BLUE, game.CYAN)
+    game.start_button = button
+
+    def update():
+        button.update_hover((0, 0))
+
+    def draw():
+        game.draw_menu()
+        button.draw()
+        game.present()
+
+    return update, draw
+
+SCENARIOS = {
+    "bullet_storm": scenario_bullet_storm,
+    "eight_players": scenario_eight_players,
+    "big_arena": scenario_big_arena,
+    "obstacles_500": scenario_obstacles_500,
+    "smg_duel": scenario_smg_duel,
+    "menu_idle": scenario_menu_idle,
+}
+
+def reset_globals():
+    game.camera_offset[:] = [0, 0]
+    game.view_offset[:] = [0, 0]
+    game.particles.clear()
+    game.particles.rng = np.random.default_rng(0)
+
+def percentiles(samples):
+    samples = np.array(samples) * 1000
+    p50, p90, p99 = np.percentile(samples, (50, 90, 99))
+    return {"p50": round(p50, 4), "p90": round(p90, 4), "p99": round(p99, 4),
+            "mean": round(float(samples.mean()), 4)}
+
+def run_scenario(name, frames, seed, warmup=10):
+    """Time update and draw per frame, then rerun to measure allocations"""
+    reset_globals()
+    update, draw = SCENARIOS[name](seed)
+    for _ in range(warmup):
+        update()
+        draw()
+    update_times = []
+    draw_times = []
+    for _ in range(frames):
+        start = time.perf_counter()
+        update()
+        middle = time.perf_counter()
+        draw()
+        update_times.append(middle - start)
+        draw_times.append(time.perf_counter() - middle)
+
+    # Allocation pass, separate because tracing skews the timings
+    reset_globals()
+    update, draw = SCENARIOS[name](seed)
+    for _ in range(warmup):
+        update()
+        draw()
+    tracemalloc.start()
+    peaks = []
+    for _ in range(frames):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        update()
+        draw()
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+
+    return {"frames": frames,
+            "update_ms": percentiles(update_times),
+            "draw_ms": percentiles(draw_times),
+            "alloc_peak_kb": {"mean": round(sum(peaks) / len(peaks) / 1024, 2),
+                              "max": round(max(peaks) / 1024, 2)}}
+
+def time_startup(runs):
+    """Launch the game with --time-startup runs times; median milliseconds
+    from launch to its first menu frame, and for the whole process"""
+    game_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "arena_game.py")
+    first_frame = []
+    process = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, game_path, "--time-startup"], capture_output=True,
+                                text=True, check=True).stdout
+        process.append((time.perf_counter() - start) * 1000)
+        first_frame.append(float(re.search(r"first menu frame after ([\d.]+) ms", output).group(1)))
+    return {"runs": runs, "first_frame_ms": round(float(np.median(first_frame)), 2),
+            "process_ms": round(float(np.median(process)), 2)}
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def print_comparison(results, baseline):
+    print(f"\nvs {baseline.get('revision') or 'baseline'} (ratio of p50 / p99, >1 is slower)")
+    for name, result in results["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if not old:
+            continue
+        cells = []
+        for key in ("update_ms", "draw_ms"):
+            for stat in ("p50", "p99"):
+                before = old[key][stat]
+                cells.append(f"{result[key][stat] / before:.2f}" if before else "-")
+        print(f"{name:<14} update {cells[0]:>5} / {cells[1]:>5}   draw {cells[2]:>5} / {cells[3]:>5}")
+    old = baseline.get("startup")
+    if results.get("startup") and old and old["first_frame_ms"]:
+        print(f"{'startup':<14} first menu frame {results['startup']['first_frame_ms'] / old['first_frame_ms']:.2f}")
+
+def bench_scenarios(args):
+    """Run the scripted stress scenarios and report per-frame percentiles"""
+    names = args.scenario or list(SCENARIOS)
+    results = {"revision": git_revision(), "seed": args.seed, "python": platform.python_version(),
+               "pygame": game.pygame.version.ver, "numpy": np.__version__, "scenarios": {}}
+    print(f"{'scenario':<14} {'update p50':>10} {'p99':>8} {'draw p50':>10} {'p99':>8} {'alloc kb':>9}")
+    for name in names:
+        result = run_scenario(name, args.frames, args.seed)
+        results["scenarios"][name] = result
+        print(f"{name:<14} {result['update_ms']['p50']:>10.3f} {result['update_ms']['p99']:>8.3f} "
+              f"{result['draw_ms']['p50']:>10.3f} {result['draw_ms']['p99']:>8.3f} "
+              f"{result['alloc_peak_kb']['mean']:>9.1f}")
+    if args.startup_runs:
+        results["startup"] = time_startup(args.startup_runs)
+        print(f"startup: first menu frame after {results['startup']['first_frame_ms']:.1f} ms "
+              f"(process {results['startup']['process_ms']:.1f} ms), median of {args.startup_runs} launches")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(results, json.load(f))
+
+BENCHMARKS = {
+    "collision": bench_collision,
+    "particles": bench_particles,
+    "idle": bench_idle,
+    "scenarios": bench_scenarios,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Arena performance benchmarks")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--frames", type=int, default=200, help="frames to average over")
+    parser.add_argument("--bullets", type=int, default=500, help="bullets in flight per frame")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--seconds", type=float, default=10, help="how long to leave each screen idle")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run (repeatable; default all)")
+    parser.add_argument("--output", metavar="PATH", help="save scenario results as JSON")
+    parser.add_argument("--compare", metavar="PATH", help="compare scenario results with a saved JSON")
+    parser.add_argument("--startup-runs", type=int, default=5,
+                        help="launches to time to the first menu frame with scenarios (0 to skip)")
+    parser.add_argument("--render-size", type=game.parse_size, metavar="WxH",
+                        help="draw at this resolution and scale it to the display")
+    parser.add_argument("--quality", choices=[level[0] for level in game.QUALITY_LEVELS], default="high",
+                        help="fixed drawing detail")
+    args = parser.parse_args()
+    game.init_display(render_size=args.render_size)
+    game.quality.set_level([level[0] for level in game.QUALITY_LEVELS].index(args.quality))
+    BENCHMARKS[args.benchmark](args)
+    game.pygame.quit()
+
+if __name__ == "__main__":
+    main()
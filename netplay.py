@@ -0,0 +1,534 @@
+"""Networked two-player arena over UDP, with rollback.
+
+Each machine controls one player (the host is player 1, the client player 2)
+with whatever it has: a controller if one is attached, otherwise keyboard and
+mouse. Peers exchange per-tick inputs and never wait for each other: the
+remote player's input is predicted (repeat the last one received), and when
+the real input arrives and differs, the match is rewound to that tick and
+re-simulated. Local input always takes effect on the next tick, whatever the
+round-trip time.
+
+    python netplay.py host 7777
+    python netplay.py join 192.168.1.20 7777
+    python netplay.py loopback --latency 60 --jitter 20 --loss 0.1
+    python netplay.py loopback --bots --ticks 20000 --latency 60 --loss 0.1
+
+--latency/--jitter/--loss add an artificial delay and packet loss to outgoing
+packets, for trying it out on one machine.
+"""
+import heapq
+import random
+import socket
+import struct
+import time
+import argparse
+
+import arena_game as game
+
+MAX_ROLLBACK = 16      # ticks we may run ahead of the last confirmed remote input
+MAX_REDUNDANT = 32     # unacknowledged inputs repeated in every packet, oldest first, to ride out loss
+HELLO_INTERVAL = 0.25  # seconds between handshake retries
+LINGER_TIMEOUT = 2.0   # seconds we keep sending after the match ends, until the peer confirms it
+
+# Packets: b"AH" hello (client -> host), b"AS" + MATCH start (host -> client),
+# b"AI" + INPUT_HEADER + inputs (both ways)
+MATCH = struct.Struct("<QHHHH")     # seed, tick rate, width, height, obstacle count
+INPUT_HEADER = struct.Struct("<IIB")  # ack (confirmed remote tick + 1), first tick, count
+INPUT = struct.Struct("<hhBhhBbb")  # move x/y, aim mode, aim a/b, fire, weapon, cycle
+
+AIM_NONE, AIM_POINT, AIM_STICK = 0, 1, 2
+
+def encode_input(player_input):
+    """Pack a PlayerInput into INPUT.size bytes (stick values to 16 bits, aim
+    points to whole pixels)"""
+    if player_input.aim_point is not None:
+        aim_mode = AIM_POINT
+        aim_a, aim_b = (round(value) for value in player_input.aim_point)
+    elif player_input.aim_stick is not None:
+        aim_mode = AIM_STICK
+        aim_a, aim_b = (round(value * 32767) for value in player_input.aim_stick)
+    else:
+        aim_mode, aim_a, aim_b = AIM_NONE, 0, 0
+    weapon = -1 if player_input.weapon is None else player_input.weapon
+    return INPUT.pack(round(player_input.move_x * 32767), round(player_input.move_y * 32767),
+                      aim_mode, aim_a, aim_b, bool(player_input.fire), weapon, player_input.cycle)
+
+def decode_input(data):
+    move_x, move_y, aim_mode, aim_a, aim_b, fire, weapon, cycle = INPUT.unpack(data)
+    player_input = game.PlayerInput(move_x / 32767, move_y / 32767, fire=bool(fire),
+                                    weapon=None if weapon < 0 else weapon, cycle=cycle)
+    if aim_mode == AIM_POINT:
+        player_input.aim_point = (aim_a, aim_b)
+    elif aim_mode == AIM_STICK:
+        player_input.aim_stick = (aim_a / 32767, aim_b / 32767)
+    return player_input
+
+NEUTRAL_INPUT = encode_input(game.PlayerInput())
+
+
+class UdpLink:
+    """Non-blocking UDP socket with an optional latency / jitter / loss shim.
+
+    Outgoing packets are dropped with probability loss and otherwise held back
+    for latency plus up to jitter seconds; flush() (called by send and recv)
+    puts due packets on the wire. clock can be swapped for a virtual clock.
+    """
+    def __init__(self, port=0, host="0.0.0.0", latency=0.0, jitter=0.0, loss=0.0,
+                 seed=None, clock=time.monotonic):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.sock.setblocking(False)
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.rng = random.Random(seed)
+        self.clock = clock
+        self.outbox = []  # heap of (release time, sequence, data, address)
+        self.sequence = 0
+        self.sent = 0
+        self.dropped = 0
+
+    @property
+    def address(self):
+        return self.sock.getsockname()
+
+    def send(self, data, address):
+        if self.loss and self.rng.random() < self.loss:
+            self.dropped += 1
+            return
+        if self.latency or self.jitter:
+            release = self.clock() + self.latency + self.rng.uniform(0, self.jitter)
+            heapq.heappush(self.outbox, (release, self.sequence, data, address))
+            self.sequence += 1
+            self.flush()
+        else:
+            self._send(data, address)
+
+    def _send(self, data, address):
+        try:
+            self.sock.sendto(data, address)
+            self.sent += 1
+        except OSError:
+            self.dropped += 1  # e.g. the peer's port isn't open yet
+
+    def flush(self):
+        now = self.clock()
+        while self.outbox and self.outbox[0][0] <= now:
+            _, _, data, address = heapq.heappop(self.outbox)
+            self._send(data, address)
+
+    def recv(self):
+        """All packets waiting on the socket, as (data, address) pairs"""
+        self.flush()
+        packets = []
+        while True:
+            try:
+                packets.append(self.sock.recvfrom(2048))
+            except (BlockingIOError, InterruptedError):
+                return packets
+            except OSError:
+                continue  # ICMP port unreachable from a peer that went away
+
+    def close(self):
+        self.sock.close()
+
+
+class RollbackMetrics:
+    """Counters for how much rewinding a session had to do"""
+    def __init__(self):
+        self.ticks = 0
+        self.predicted = 0       # ticks stepped before the remote input arrived
+        self.mispredicted = 0    # of those, ticks where the guess was wrong
+        self.rollbacks = 0
+        self.max_depth = 0
+        self.resimulated = 0     # ticks re-run by rollbacks
+        self.resim_time = 0.0    # seconds spent re-running them
+        self.max_resim_time = 0.0
+        self.stalls = 0          # advance() calls refused for being too far ahead
+
+    def record_rollback(self, depth, elapsed):
+        self.rollbacks += 1
+        self.max_depth = max(self.max_depth, depth)
+        self.resimulated += depth
+        self.resim_time += elapsed
+        self.max_resim_time = max(self.max_resim_time, elapsed)
+
+    def summary(self):
+        mean_depth = self.resimulated / self.rollbacks if self.rollbacks else 0
+        mean_ms = self.resim_time / self.rollbacks * 1000 if self.rollbacks else 0
+        return (f"{self.ticks} ticks, {self.predicted} predicted ({self.mispredicted} wrong), "
+                f"{self.rollbacks} rollbacks (depth mean {mean_depth:.1f}, max {self.max_depth}), "
+                f"resim {mean_ms:.3f} ms mean / {self.max_resim_time * 1000:.3f} ms max, "
+                f"{self.stalls} stalls")
+
+
+class RollbackSession:
+    """Keeps one ArenaSimulation in step with a remote peer.
+
+    advance() steps the match one tick with the local input and the remote
+    input if it has arrived, or a prediction if not. Snapshots are kept for
+    every tick that still depends on a prediction; when a remote input turns
+    out to differ from what was predicted, the match is restored to that tick
+    and re-simulated up to the present before the next tick runs.
+    """
+    def __init__(self, sim, local_index, link, peer, max_rollback=MAX_ROLLBACK, start_packet=None):
+        self.sim = sim
+        self.local_index = local_index
+        self.link = link
+        self.peer = peer
+        self.max_rollback = max_rollback
+        self.start_packet = start_packet  # resent to a client whose hello we see again
+        self.local_inputs = {}   # tick -> encoded input
+        self.remote_inputs = {}  # tick -> encoded input, as received
+        self.predicted = {}      # tick -> encoded input we guessed for the peer
+        self.snapshots = {}      # tick -> sim.snapshot() from just before that tick
+        self.confirmed = -1      # last tick for which every earlier remote input is in
+        self.remote_ack = -1     # last of our ticks the peer has confirmed
+        self.rollback_from = None
+        self.metrics = RollbackMetrics()
+
+    def can_advance(self):
+        if self.start_packet and self.confirmed < 0:
+            return False  # the host waits for the client's first input, so it knows the client is listening
+        return not self.sim.winner and self.sim.ticks - self.confirmed <= self.max_rollback
+
+    def settled(self):
+        """True once every tick simulated so far used real remote input"""
+        return self.confirmed >= self.sim.ticks - 1
+
+    def delivered(self):
+        """True once the peer has confirmed every tick simulated so far"""
+        return self.remote_ack >= self.sim.ticks - 1
+
+    def advance(self, local_input):
+        """Step one tick; returns its events, or None if we're too far ahead
+        of the peer (or the match is over) and have to wait"""
+        self.poll()
+        if not self.can_advance():
+            self.metrics.stalls += 1
+            self.send()
+            return None
+
+        tick = self.sim.ticks
+        # A rollback that takes back a win can bring us back to ticks whose
+        # input already went out; those have to stay what the peer was sent
+        self.local_inputs.setdefault(tick, encode_input(local_input))
+        self.send()
+        self.snapshots[tick] = self.sim.snapshot()
+        events = self.sim.step(self._inputs_for(tick))
+        self.metrics.ticks += 1
+        if tick not in self.remote_inputs:
+            self.metrics.predicted += 1
+        return events
+
+    def poll(self):
+        """Take in the peer's packets and roll back if they contradict a prediction"""
+        for data, address in self.link.recv():
+            if address != self.peer:
+                continue
+            kind = data[:2]
+            if kind == b"AH" and self.start_packet:
+                self.link.send(self.start_packet, self.peer)
+            elif kind == b"AI":
+                self._receive_inputs(data)
+        self._rollback()
+        self._prune()
+
+    def send(self):
+        """Send the local inputs the peer hasn't confirmed, oldest first (up to
+        MAX_REDUNDANT), so one it has missed is always resent until it's in.
+        With none left to send the packet still carries our ack, which the
+        peer is waiting on at the end of a match."""
+        first = self.remote_ack + 1
+        last = min(self.sim.ticks, first + MAX_REDUNDANT) - 1
+        inputs = [self.local_inputs[tick] for tick in range(first, last + 1)]
+        self.link.send(b"AI" + INPUT_HEADER.pack(self.confirmed + 1, first, len(inputs)) + b"".join(inputs),
+                       self.peer)
+
+    def _receive_inputs(self, data):
+        ack, first, count = INPUT_HEADER.unpack_from(data, 2)
+        self.remote_ack = max(self.remote_ack, ack - 1)
+        offset = 2 + INPUT_HEADER.size
+        for i in range(count):
+            tick = first + i
+            encoded = data[offset + i * INPUT.size:offset + (i + 1) * INPUT.size]
+            if tick in self.remote_inputs:
+                continue
+            self.remote_inputs[tick] = encoded
+            guess = self.predicted.pop(tick, None)
+            if guess is not None and guess != encoded:
+                self.metrics.mispredicted += 1
+                if self.rollback_from is None or tick < self.rollback_from:
+                    self.rollback_from = tick
+
+        while self.confirmed + 1 in self.remote_inputs:
+            self.confirmed += 1
+
+    def _prune(self):
+        """Forget what no rollback or resend can need any more. Inputs for ticks
+        we haven't (re)simulated yet stay, even confirmed ones: a rollback that
+        takes back a win can leave the match behind what both sides confirmed."""
+        done = self.sim.ticks - 1
+        for tick in [tick for tick in self.snapshots if tick <= self.confirmed]:
+            del self.snapshots[tick]
+        for tick in [tick for tick in self.local_inputs if tick <= min(self.remote_ack, self.confirmed, done)]:
+            del self.local_inputs[tick]
+        for tick in [tick for tick in self.remote_inputs if tick < min(self.confirmed, done)]:
+            del self.remote_inputs[tick]
+
+    def _predict(self, tick):
+        """Guess the peer's input: whatever they last sent, minus one-shot key presses"""
+        last = self.remote_inputs.get(min(self.confirmed, tick - 1))
+        if last is None:
+            return NEUTRAL_INPUT
+        guess = decode_input(last)
+        guess.weapon = None
+        return encode_input(guess)
+
+    def _inputs_for(self, tick):
+        remote = self.remote_inputs.get(tick)
+        if remote is None:
+            remote = self.predicted[tick] = self._predict(tick)
+        inputs = [None, None]
+        inputs[self.local_index] = decode_input(self.local_inputs[tick])
+        inputs[1 - self.local_index] = decode_input(remote)
+        return inputs
+
+    def _rollback(self):
+        start = self.rollback_from
+        self.rollback_from = None
+        if start is None or start not in self.snapshots:
+            return
+        end = self.sim.ticks
+        began = time.perf_counter()
+        self.sim.restore(self.snapshots[start])
+        for tick in range(start, end):
+            self.snapshots[tick] = self.sim.snapshot()
+            self.predicted.pop(tick, None)
+            self.sim.step(self._inputs_for(tick))
+            if self.sim.winner:
+                # The match now ends here, as it does for the peer; what we
+                # simulated past this tick never happened
+                for later in range(tick + 1, end):
+                    self.snapshots.pop(later, None)
+                    self.predicted.pop(later, None)
+                break
+        self.metrics.record_rollback(self.sim.ticks - start, time.perf_counter() - began)
+
+
+def local_input(state):
+    """This machine's player uses a controller if one is attached, else keyboard and mouse"""
+    if state.pads[0]:
+        return game.controller_input(state.pads[0])
+    return game.keyboard_mouse_input(state)
+
+def host(link, tick_rate, timeout=60.0):
+    """Wait for a client's hello and start a match with it"""
+    print(f"Waiting for a player on port {link.address[1]}...")
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for data, address in link.recv():
+            if data[:2] == b"AH":
+                seed = random.randrange(2 ** 63)
+                sim = game.ArenaSimulation(seed=seed, tick_rate=tick_rate)
+                start = b"AS" + MATCH.pack(seed, sim.tick_rate, sim.width, sim.height, len(sim.obstacles))
+                link.send(start, address)
+                return RollbackSession(sim, 0, link, address, start_packet=start)
+        pygame_wait(0.01)
+    raise TimeoutError("no player joined")
+
+def join(link, address, timeout=60.0):
+    """Say hello to a host until it starts a match"""
+    print(f"Joining {address[0]}:{address[1]}...")
+    deadline = time.monotonic() + timeout
+    next_hello = 0.0
+    while time.monotonic() < deadline:
+        if time.monotonic() >= next_hello:
+            link.send(b"AH", address)
+            next_hello = time.monotonic() + HELLO_INTERVAL
+        for data, sender in link.recv():
+            if data[:2] == b"AS" and sender == address:
+                seed, tick_rate, width, height, obstacle_count = MATCH.unpack_from(data, 2)
+                sim = game.ArenaSimulation(width, height, seed, obstacle_count, tick_rate=tick_rate)
+                return RollbackSession(sim, 1, link, address)
+        pygame_wait(0.01)
+    raise TimeoutError("host did not answer")
+
+def pygame_wait(seconds):
+    game.pygame.event.pump()
+    time.sleep(seconds)
+
+def play_networked(session, dirty_rects=False, fps=game.FPS):
+    """play_match() for a networked session; returns False if the window was closed"""
+    sim = session.sim
+    bindings = game.InputBindings(1, keyboard_player=None)
+    game.particles.clear()
+    game.update_camera(sim, 0, snap=True)
+    presenter = game.Presenter(dirty_rects)
+    game.quality.budget = 1 / (fps or game.FPS)
+    accumulator = 0.0
+    pending_weapon_key = None
+    linger_until = None
+    last_time = time.perf_counter()
+    while True:
+        game.clock.tick(fps)
+        now = time.perf_counter()
+        frame_time = min(now - last_time, game.MAX_FRAME_TIME)
+        last_time = now
+        accumulator += frame_time
+
+        events = game.pygame.event.get()
+        for event in events:
+            if event.type == game.pygame.QUIT:
+                return False
+
+        state = game.sample_devices(events, bindings)
+        if state.weapon_key is None:
+            state.weapon_key = pending_weapon_key
+
+        steps = 0
+        while accumulator >= sim.dt:
+            sim_events = session.advance(local_input(state))
+            if sim_events is None:
+                # Too far ahead of the peer: hold this tick until they catch up
+                accumulator = min(accumulator, sim.dt)
+                break
+            game.play_events(sim_events)
+            game.spawn_effects(sim_events)
+            accumulator -= sim.dt
+            state.weapon_key = None
+            steps += 1
+            if steps >= game.MAX_STEPS_PER_FRAME:
+                accumulator = min(accumulator, sim.dt)
+                break
+        if not steps:
+            session.poll()
+        pending_weapon_key = state.weapon_key
+        game.sounds.flush()
+        alpha = min(1.0, accumulator / sim.dt)
+        game.particles.update(frame_time)
+
+        game.update_camera(sim, frame_time)
+
+        presenter.begin(sim.arena)
+        rects = game.draw_simulation(sim, alpha)
+
+        # Only end the match once the winning tick no longer rests on a prediction,
+        # and not before the peer has our inputs up to it too (advance() keeps
+        # resending them), or it could stall waiting for packets we've stopped
+        # sending; a peer that has gone quiet gets LINGER_TIMEOUT after the win
+        if not sim.winner:
+            linger_until = None
+        elif linger_until is None:
+            linger_until = now + LINGER_TIMEOUT
+        if sim.winner and (session.settled() and session.delivered() or now >= linger_until):
+            return game.show_game_over(sim.winner, sim.winner_color)
+
+        presenter.end(rects)
+        game.quality.frame(time.perf_counter() - now)
+
+def run_loopback(ticks, latency, jitter, loss, seed, bots=False):
+    """Two headless peers on 127.0.0.1 playing random inputs through the shim,
+    or with bots each peer's player is a bot deciding on that peer's own
+    (possibly predicted) view of the match, so the match usually ends in a win.
+
+    Time is virtual (one tick per loop), so this runs as fast as the CPU allows.
+    At the end both peers must agree on the final tick and state.
+    """
+    now = [0.0]
+    clock = lambda: now[0]
+    rng = random.Random(seed)
+    links = [UdpLink(host="127.0.0.1", latency=latency, jitter=jitter, loss=loss,
+                     seed=rng.random(), clock=clock) for _ in range(2)]
+    match_seed = rng.randrange(2 ** 63)
+    sessions = [RollbackSession(game.ArenaSimulation(1200, 700, match_seed), index, links[index],
+                                links[1 - index].address)
+                for index in range(2)]
+    input_rngs = [random.Random(rng.random()) for _ in range(2)]
+    squads = [game.BotSquad([index], rng.random()) for index in range(2)] if bots else None
+
+    def finished(session):
+        return ((session.sim.ticks >= ticks or session.sim.winner)
+                and session.settled() and session.delivered())
+
+    def progress():
+        return [(session.sim.ticks, session.confirmed, session.remote_ack) for session in sessions]
+
+    # Play on until both sides agree the match is over and have every input,
+    # giving up if nothing moves for a few seconds
+    dt = sessions[0].sim.dt
+    last_progress, deadline = progress(), time.monotonic() + 5
+    while not all(finished(session) for session in sessions) and time.monotonic() < deadline:
+        now[0] += dt
+        for index, session in enumerate(sessions):
+            if session.sim.ticks < ticks and not session.sim.winner:
+                if squads:
+                    player_input = squads[index].decide(session.sim)[index]
+                else:
+                    player_input = game.random_input(input_rngs[index])
+                session.advance(player_input)
+            else:
+                session.poll()
+                session.send()
+        time.sleep(0)  # let the loopback packets land
+        if progress() != last_progress:
+            last_progress, deadline = progress(), time.monotonic() + 5
+
+    for index, session in enumerate(sessions):
+        print(f"peer {index + 1}: {session.metrics.summary()}; "
+              f"{session.link.sent} packets sent, {session.link.dropped} dropped")
+    digests = [session.sim.digest() for session in sessions]
+    end_ticks = [session.sim.ticks for session in sessions]
+    complete = all(finished(session) for session in sessions)
+    in_sync = (complete and digests[0] == digests[1] and end_ticks[0] == end_ticks[1]
+               and sessions[0].sim.winner == sessions[1].sim.winner)
+    print(f"{'/'.join(map(str, end_ticks))} ticks, winner {sessions[0].sim.winner or '-'}, "
+          f"final state {' / '.join(digests)}: {'in sync' if in_sync else 'DESYNC'}"
+          f"{'' if complete else ' (stalled before both sides had every input and ack)'}")
+    for link in links:
+        link.close()
+    return in_sync
+
+def main():
+    parser = argparse.ArgumentParser(description="Networked 2 Player Arena")
+    parser.add_argument("mode", choices=("host", "join", "loopback"))
+    parser.add_argument("address", nargs="*", help="host: PORT; join: HOST PORT")
+    parser.add_argument("--latency", type=float, default=0, help="ms added to every outgoing packet")
+    parser.add_argument("--jitter", type=float, default=0, help="up to this many extra ms per packet")
+    parser.add_argument("--loss", type=float, default=0, help="fraction of outgoing packets dropped")
+    parser.add_argument("--tick-rate", type=int, default=game.SIM_RATE, help="simulation ticks per second")
+    parser.add_argument("--fps", type=int, default=game.FPS, help="render frame cap (0 for uncapped)")
+    parser.add_argument("--dirty-rects", action="store_true")
+    parser.add_argument("--render-size", type=game.parse_size, metavar="WxH",
+                        help="draw the scene at this resolution and scale it to the display")
+    parser.add_argument("--ticks", type=int, default=3000, help="ticks to play in loopback mode")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--bots", action="store_true",
+                        help="loopback: bots play both sides, so the match can end in a win")
+    args = parser.parse_args()
+    latency, jitter = args.latency / 1000, args.jitter / 1000
+
+    if args.mode == "loopback":
+        ok = run_loopback(args.ticks, latency, jitter, args.loss, args.seed, args.bots)
+        game.pygame.quit()
+        raise SystemExit(0 if ok else 1)
+
+    game.init_display(render_size=args.render_size)
+    game.finish_startup()
+    if args.mode == "host":
+        port = int(args.address[0]) if args.address else 7777
+        link = UdpLink(port, latency=latency, jitter=jitter, loss=args.loss)
+        session = host(link, args.tick_rate)
+    else:
+        if len(args.address) != 2:
+            parser.error("join needs HOST PORT")
+        link = UdpLink(latency=latency, jitter=jitter, loss=args.loss)
+        session = join(link, (socket.gethostbyname(args.address[0]), int(args.address[1])))
+
+    play_networked(session, args.dirty_rects, args.fps)
+    print(session.metrics.summary())
+    link.close()
+    game.pygame.quit()
+
+if __name__ == "__main__":
+    main()
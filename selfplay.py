@@ -0,0 +1,129 @@
+"""Bot-vs-bot self-play, for tuning BotSquad and the WEAPONS table.
+
+Plays many headless matches across a process pool. Each match is between two
+bot settings, A and B, with the players split between them and the spawn
+sides alternating from match to match; A's win rate, match length, shots per
+weapon and the bots' decision time are reported at the end.
+
+    python selfplay.py --matches 400 --workers 8
+    python selfplay.py --a aim_error=0.02 --b aim_error=0.1
+    python selfplay.py --weapon 2.damage=25 --weapon 0.delay=100 --players 4
+
+--a/--b take BotParams fields; --weapon takes WEAPON.FIELD=VALUE and changes
+the WEAPONS table in every worker for the whole run.
+"""
+import os
+import random
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import arena_game as game
+
+ARENA_WIDTH, ARENA_HEIGHT = 1200, 700
+MAX_TICKS = 60 * game.SIM_RATE  # a match still going after a minute is a draw
+
+def parse_weapon_overrides(settings):
+    """[(weapon, field, value)] from "WEAPON.FIELD=VALUE" strings"""
+    overrides = []
+    for setting in settings:
+        key, _, value = setting.partition("=")
+        weapon, _, field = key.partition(".")
+        weapon = int(weapon)
+        if weapon not in game.WEAPONS or field not in game.WEAPONS[weapon] or field in ("name", "color"):
+            raise ValueError(f"can't tune {key!r}")
+        overrides.append((weapon, field, type(game.WEAPONS[weapon][field])(value)))
+    return overrides
+
+def init_worker(weapon_overrides):
+    for weapon, field, value in weapon_overrides:
+        game.WEAPONS[weapon][field] = value
+
+def play_match(seed, player_count, params_a, params_b, tick_rate, arena_path=None):
+    """One headless match, on a random arena unless arena_path is given;
+    players alternate between A and B, starting with A on even seeds. Returns
+    the winning side ("A", "B" or None) and stats."""
+    rng = random.Random(seed)
+    arena = game.load_arena(arena_path) if arena_path else None
+    sim = game.ArenaSimulation(ARENA_WIDTH, ARENA_HEIGHT, rng.randrange(2 ** 63),
+                               tick_rate=tick_rate, player_count=player_count, arena=arena)
+    sides = ["AB"[(i + seed) % 2] for i in range(player_count)]
+    squads = {side: game.BotSquad([i for i in range(player_count) if sides[i] == side], rng.random(), params)
+              for side, params in (("A", params_a), ("B", params_b))}
+    shots = [0] * len(game.WEAPONS)
+    max_ticks = MAX_TICKS * tick_rate // game.SIM_RATE
+    while not sim.winner and sim.ticks < max_ticks:
+        decided = {}
+        for squad in squads.values():
+            decided.update(squad.decide(sim))
+        sim.step([decided[i] for i in range(player_count)])
+        for shooter, weapon in sim.shots:
+            shots[weapon] += 1
+
+    # Last side standing wins, even if some of its players fell too
+    alive = {sides[i] for i, player in enumerate(sim.players) if player.hp > 0}
+    return {"winner": alive.pop() if len(alive) == 1 else None,
+            "ticks": sim.ticks,
+            "shots": shots,
+            "decisions": sum(squad.decisions for squad in squads.values()),
+            "decision_us": sum(squad.total_us for squad in squads.values()),
+            "worst_us": max(squad.worst_us for squad in squads.values()),
+            "over_budget": sum(squad.over_budget for squad in squads.values())}
+
+def run_selfplay(matches, workers, player_count, params_a, params_b, weapon_overrides, seed, tick_rate,
+                 arena_path=None):
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(weapon_overrides,)) as pool:
+        futures = [pool.submit(play_match, seed + i, player_count, params_a, params_b, tick_rate, arena_path)
+                   for i in range(matches)]
+        results = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+
+    wins_a = sum(result["winner"] == "A" for result in results)
+    wins_b = sum(result["winner"] == "B" for result in results)
+    ticks = sum(result["ticks"] for result in results)
+    shots = [sum(result["shots"][weapon] for result in results) for weapon in range(len(game.WEAPONS))]
+    decisions = sum(result["decisions"] for result in results)
+    print(f"{matches} matches in {elapsed:.1f}s ({ticks / elapsed:.0f} ticks/s across {workers or os.cpu_count()} workers)")
+    print(f"A won {wins_a} ({100 * wins_a / matches:.1f}%), B won {wins_b} ({100 * wins_b / matches:.1f}%), "
+          f"{matches - wins_a - wins_b} drawn; mean match {ticks / matches / tick_rate:.1f}s")
+    print("shots: " + ", ".join(f"{game.WEAPONS[weapon]['name']} {count}" for weapon, count in enumerate(shots)))
+    print(f"bot decisions: {sum(result['decision_us'] for result in results) / max(decisions, 1):.0f} us mean / "
+          f"{max(result['worst_us'] for result in results):.0f} us max per tick, "
+          f"{sum(result['over_budget'] for result in results)} of {decisions} over the "
+          f"{game.BOT_BUDGET_US} us budget")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Bot-vs-bot self-play")
+    parser.add_argument("--matches", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=None, help="processes to play on (default one per CPU)")
+    parser.add_argument("--players", type=int, default=2, help=f"players per match (2-{game.MAX_PLAYERS})")
+    parser.add_argument("--a", action="append", default=[], metavar="NAME=VALUE", help="BotParams for side A")
+    parser.add_argument("--b", action="append", default=[], metavar="NAME=VALUE", help="BotParams for side B")
+    parser.add_argument("--weapon", action="append", default=[], metavar="WEAPON.FIELD=VALUE",
+                        help="override a WEAPONS entry, e.g. 2.damage=25")
+    parser.add_argument("--arena", metavar="PATH", help="play every match on this arena file")
+    parser.add_argument("--tick-rate", type=int, default=game.SIM_RATE, help="simulation ticks per second")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    if not game.MIN_PLAYERS <= args.players <= game.MAX_PLAYERS:
+        parser.error(f"--players must be {game.MIN_PLAYERS}-{game.MAX_PLAYERS}")
+    try:
+        params_a = game.BotParams.parse(args.a)
+        params_b = game.BotParams.parse(args.b)
+        weapon_overrides = parse_weapon_overrides(args.weapon)
+        if args.arena:
+            game.load_arena(args.arena)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+
+    run_selfplay(args.matches, args.workers, args.players, params_a, params_b, weapon_overrides,
+                 args.seed, args.tick_rate, args.arena)
+    game.pygame.quit()
+
+if __name__ == "__main__":
+    main()